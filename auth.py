@@ -1,27 +1,114 @@
 # auth.py
-from fastapi import Depends, HTTPException
+from typing import Dict, Optional, Tuple
+from collections import OrderedDict
+import hashlib
+import hmac
+import threading
+import time
+from fastapi import Depends, Header, HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import jwt
 from jwt import InvalidTokenError, ExpiredSignatureError, InvalidSignatureError
-from settings import JWT_SECRET, JWT_ISSUER, JWT_AUDIENCE
+from settings import JWT_SECRET, JWT_ISSUER, JWT_AUDIENCE, ADMIN_TOKEN, JWT_CACHE_MAX
+from core.metricas import medir
 
 security = HTTPBearer()
 
-def require_user(token: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+LEEWAY = 10  # tolerancia por desfasaje de reloj (segundos)
+
+
+class CacheTokens:
+    """
+    Claims de JWT ya verificados, por hash del token, hasta su exp (+ leeway).
+    LRU acotado a `max_entradas`.
+    """
+
+    def __init__(self, max_entradas: int):
+        self.max_entradas = max(1, max_entradas)
+        self._datos: "OrderedDict[bytes, Tuple[dict, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave: bytes) -> Optional[dict]:
+        ahora = time.time()
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is not None:
+                claims, vence = entrada
+                if vence > ahora:
+                    self._datos.move_to_end(clave)
+                    self.aciertos += 1
+                    return claims
+                del self._datos[clave]
+            self.fallos += 1
+            return None
+
+    def guardar(self, clave: bytes, claims: dict):
+        vence = float(claims["exp"]) + LEEWAY
+        with self._lock:
+            self._datos[clave] = (claims, vence)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def estadisticas(self) -> Dict:
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                "entradas": len(self._datos),
+                "max_entradas": self.max_entradas,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "ratio_aciertos": round(self.aciertos / consultas, 4) if consultas else 0.0,
+            }
+
+
+cache_tokens = CacheTokens(JWT_CACHE_MAX)
+
+
+def _decodificar(token: str) -> dict:
+    clave = hashlib.blake2b(token.encode("utf-8"), digest_size=20).digest()
+    payload = cache_tokens.obtener(clave)
+    if payload is not None:
+        return payload
+    payload = jwt.decode(
+        token,
+        JWT_SECRET,
+        algorithms=["HS256"],
+        issuer=JWT_ISSUER,
+        audience=JWT_AUDIENCE,
+        options={"require": ["exp", "iss", "aud", "sub"]},
+        leeway=LEEWAY,
+    )
+    cache_tokens.guardar(clave, payload)
+    return payload
+
+
+def require_user(
+    token: HTTPAuthorizationCredentials = Depends(security),
+    cuit: Optional[str] = Header(None, alias="CUIT-CLIENTE"),
+) -> dict:
     try:
-        payload = jwt.decode(
-            token.credentials,
-            JWT_SECRET,
-            algorithms=["HS256"],
-            issuer=JWT_ISSUER,
-            audience=JWT_AUDIENCE,
-            options={"require": ["exp", "iss", "aud", "sub"]},
-            leeway=10,  # tolerancia por desfasaje de reloj (segundos)
-        )
-        return payload  # contiene sub, name, roles, etc.
+        with medir("jwt"):
+            payload = _decodificar(token.credentials)
     except ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expirado")
     except InvalidSignatureError:
         raise HTTPException(status_code=401, detail="Firma inválida")
     except InvalidTokenError:
         raise HTTPException(status_code=401, detail="Token inválido")
+
+    # Un token emitido para un cliente (claim tenant) no sirve con el CUIT de otro
+    tenant = payload.get("tenant")
+    if tenant is not None and cuit is not None and str(tenant) != cuit:
+        raise HTTPException(status_code=401, detail="Token no corresponde al cliente")
+    return payload  # contiene sub, name, roles, etc.
+
+
+def require_admin(admin_token: Optional[str] = Header(None, alias="X-Admin-Token")) -> None:
+    """Endpoints de administración: header X-Admin-Token igual a ADMIN_TOKEN (si no está configurado, no hay acceso)."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not admin_token or not hmac.compare_digest(admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="No autorizado")
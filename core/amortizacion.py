@@ -0,0 +1,23 @@
+# API_TARJETA_MULTI\core\amortizacion.py
+# Factor de amortización del sistema francés (cuota = monto * factor).
+# Los planes forman pocos pares (tasa, cuotas) distintos, así que el factor se memoriza.
+from functools import lru_cache
+from typing import Optional
+
+
+@lru_cache(maxsize=4096)
+def factor_amortizacion(tasa_interes_mensual: float, cuotas: int) -> Optional[float]:
+    """Factor del sistema francés (cuota = monto * factor). None si la tasa es 0."""
+    m = 1
+    nTEM = tasa_interes_mensual / 100  # convertir tasa de porcentaje a decimal
+    nTEM = ((1 + nTEM) ** m) - 1
+    if nTEM == 0:
+        return None
+    return ((((1 + nTEM) ** cuotas) - 1) / (nTEM * (1 + nTEM) ** cuotas)) ** -1
+
+
+def valor_cuota(monto: float, cuotas: int, factor: Optional[float]) -> float:
+    """Importe de cada cuota a partir del factor de factor_amortizacion (None = sin interés)."""
+    if factor is None:
+        return monto * 1 / cuotas
+    return round(monto * factor, 2)
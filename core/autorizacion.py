@@ -0,0 +1,226 @@
+# API_TARJETA_MULTI\core\autorizacion.py
+# Códigos de autorización numéricos que entran en un INT de 32 bits, como el DDDHHMMSS original
+# (hasta 2147483647): (segundo del día * NODOS + nodo) * POR_SEGUNDO + contador.
+# Nodo y contador evitan que dos compras del mismo segundo (en el mismo proceso o en otro
+# worker) reciban el mismo código. Cada proceso toma un nodo libre en la DB maestra (NodoAutorizacion).
+# Los códigos son únicos dentro de cada día (UTC) y se repiten de un día a otro: para identificar
+# una autorización hay que usar el código junto con la fecha de la compra (el DDDHHMMSS anterior,
+# con un código por segundo, se repetía de un año a otro).
+import threading
+import time
+from typing import List, Optional
+
+import pyodbc
+from fastapi import HTTPException
+
+from core.database import _master_conn_str
+from settings import AUTORIZACION_NODOS, AUTORIZACION_LEASE_SEG
+
+SEGUNDOS_DIA = 86400
+NODOS = 10                  # nodos 0-9
+POR_SEGUNDO = 2485          # códigos por segundo y por nodo: 86400 * 10 * 2485 < 2^31
+MAX_CODIGO = 2 ** 31 - 1
+MAX_ADELANTO = 2            # segundos que el contador puede adelantarse al reloj
+
+assert SEGUNDOS_DIA * NODOS * POR_SEGUNDO - 1 <= MAX_CODIGO
+
+
+def leer_nodos(valor: str) -> List[int]:
+    """Nodos de AUTORIZACION_NODOS ("0-9", "0-4", "5,7-9"...). Lanza ValueError si alguno no está entre 0 y 9."""
+    nodos = set()
+    try:
+        for parte in valor.split(","):
+            parte = parte.strip()
+            if not parte:
+                continue
+            desde, _, hasta = parte.partition("-")
+            nodos.update(range(int(desde), int(hasta or desde) + 1))
+    except ValueError:
+        raise ValueError(f"AUTORIZACION_NODOS inválido: {valor!r}")
+    if not nodos or min(nodos) < 0 or max(nodos) >= NODOS:
+        raise ValueError(f"AUTORIZACION_NODOS debe indicar nodos entre 0 y {NODOS - 1}: {valor!r}")
+    return sorted(nodos)
+
+
+class GeneradorAutorizacion:
+    """
+    Genera códigos únicos por nodo. Si en un segundo se agotan los POR_SEGUNDO números del
+    contador se toma prestado el segundo siguiente (a lo sumo MAX_ADELANTO segundos por delante
+    del reloj; si no, se espera), así que los códigos nunca se repiten aunque el reloj retroceda.
+    Sin nodo asignado, o con el nodo vencido (no se pudo renovar), siguiente() responde 503.
+    """
+
+    def __init__(self, nodo: Optional[int] = None):
+        self._lock = threading.Lock()
+        self.nodo: Optional[int] = None
+        self._vigente_hasta: Optional[float] = None
+        if nodo is not None:
+            self.asignar(nodo)
+
+    def asignar(self, nodo: int, desde: int = 0, vigente_hasta: Optional[float] = None):
+        """
+        Empieza a generar con `nodo` a partir del segundo siguiente a `desde` (época UTC).
+        vigente_hasta (time.monotonic) = hasta cuándo vale el nodo si no se renueva; None = sin vencimiento.
+        """
+        if not 0 <= nodo < NODOS:
+            raise ValueError(f"Nodo de autorización fuera de rango (0-{NODOS - 1}): {nodo}")
+        with self._lock:
+            self.nodo = nodo
+            self._segundo = desde
+            self._contador = POR_SEGUNDO - 1
+            self._base = 0
+            self._vigente_hasta = vigente_hasta
+
+    def renovar(self, vigente_hasta: float):
+        with self._lock:
+            self._vigente_hasta = vigente_hasta
+
+    def suspender(self):
+        with self._lock:
+            self.nodo = None
+
+    def siguiente(self) -> str:
+        with self._lock:
+            if self.nodo is None:
+                raise HTTPException(status_code=503, detail="Generador de autorizaciones sin nodo asignado")
+            ahora = int(time.time())
+            if ahora > self._segundo:
+                self._segundo, self._contador = ahora, 0
+                self._base = self._calcular_base(ahora)
+            elif self._contador < POR_SEGUNDO - 1:
+                self._contador += 1
+            else:
+                espera = self._segundo + 1 - MAX_ADELANTO - time.time()
+                if espera > 0:
+                    time.sleep(espera)
+                self._segundo, self._contador = self._segundo + 1, 0
+                self._base = self._calcular_base(self._segundo)
+            # Se controla al final: la espera de arriba no puede pasarse del vencimiento del nodo
+            if self._vigente_hasta is not None and time.monotonic() > self._vigente_hasta:
+                raise HTTPException(status_code=503, detail="Nodo de autorización vencido")
+            codigo = self._base + self._contador
+        return str(codigo)
+
+    def _calcular_base(self, segundo: int) -> int:
+        # Segundo del día en UTC: sin saltos ni repeticiones por cambios de horario
+        return ((segundo % SEGUNDOS_DIA) * NODOS + self.nodo) * POR_SEGUNDO
+
+
+_SQL_TOMAR_NODO = """
+SET NOCOUNT ON;
+DECLARE @r INT;
+EXEC @r = sp_getapplock @Resource = ?, @LockMode = 'Exclusive', @LockOwner = 'Session', @LockTimeout = 0;
+SELECT @r;
+"""
+_SQL_VERIFICAR_NODO = "SELECT APPLOCK_MODE('public', ?, 'Session')"
+
+
+def _recurso(nodo: int) -> str:
+    return f"api_tarjeta.autorizacion.nodo.{nodo}"
+
+
+class NodoAutorizacion:
+    """
+    Asigna al generador un nodo que ningún otro proceso (de este u otro servidor) está usando:
+    lo toma con un sp_getapplock de sesión en la DB maestra, sobre una conexión que se mantiene
+    abierta mientras viva el proceso. Si el proceso o la conexión se caen, SQL Server libera el
+    nodo y otro proceso puede tomarlo.
+    El nodo se verifica cada lease/3 segundos; si no se pudo verificar en `lease` segundos el
+    generador deja de dar códigos. Quien toma un nodo espera lease + 1 segundos y empieza después
+    del último segundo que pudo usar el dueño anterior (su último segundo verificado + lease +
+    MAX_ADELANTO). Requiere los relojes de los servidores sincronizados (NTP).
+    """
+
+    def __init__(self, generador: GeneradorAutorizacion, nodos: List[int], lease: int):
+        self.generador = generador
+        self.nodos = nodos
+        self.lease = max(3, int(lease))
+        self.nodo: Optional[int] = None
+        self._conn: Optional[pyodbc.Connection] = None
+        self._fin = threading.Event()
+        self._activo = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def iniciar(self, espera: Optional[float] = None):
+        """Arranca la toma y renovación del nodo en segundo plano y espera (a lo sumo `espera`) a tenerlo."""
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, name="nodo-autorizacion", daemon=True)
+            self._hilo.start()
+        self._activo.wait(self.lease + 10 if espera is None else espera)
+
+    def cerrar(self):
+        self._fin.set()
+        self.generador.suspender()
+        self._cerrar_conexion()
+
+    def _bucle(self):
+        while not self._fin.is_set():
+            try:
+                if self._conn is None:
+                    self._tomar()
+                else:
+                    self._verificar()
+            except Exception:
+                # DB maestra caída o nodo perdido: no se dan códigos hasta tomar un nodo de nuevo
+                self._activo.clear()
+                self.generador.suspender()
+                self._cerrar_conexion()
+            self._fin.wait(self.lease / 3)
+
+    def _tomar(self):
+        conn = pyodbc.connect(_master_conn_str(), autocommit=True, timeout=self.lease)
+        conn.timeout = self.lease
+        self._conn = conn
+        cursor = conn.cursor()
+        try:
+            for nodo in self.nodos:
+                tomado = int(time.time())
+                cursor.execute(_SQL_TOMAR_NODO, _recurso(nodo))
+                if cursor.fetchone()[0] >= 0:
+                    break
+            else:
+                raise RuntimeError(f"No hay nodos de autorización libres entre {self.nodos}")
+        finally:
+            cursor.close()
+        self.nodo = nodo
+        # El dueño anterior pudo dar códigos hasta `lease` segundos después de perder el nodo
+        self._fin.wait(max(0.0, tomado + self.lease + 1 - time.time()))
+        vigente_hasta = self._vigente_desde_ahora()
+        self.generador.asignar(nodo, desde=tomado + self.lease + MAX_ADELANTO, vigente_hasta=vigente_hasta)
+        self._activo.set()
+
+    def _verificar(self):
+        self.generador.renovar(self._vigente_desde_ahora())
+
+    def _vigente_desde_ahora(self) -> float:
+        # El plazo corre desde antes de la consulta: si tarda, el nodo vence antes, nunca después
+        inicio = time.monotonic()
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute(_SQL_VERIFICAR_NODO, _recurso(self.nodo))
+            modo = cursor.fetchone()[0]
+        finally:
+            cursor.close()
+        if modo != "Exclusive":
+            raise RuntimeError(f"Se perdió el nodo de autorización {self.nodo}")
+        return inicio + self.lease
+
+    def _cerrar_conexion(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                conn.close()
+            except pyodbc.Error:
+                pass
+
+
+generador_autorizacion = GeneradorAutorizacion()
+nodo_autorizacion = NodoAutorizacion(generador_autorizacion, leer_nodos(AUTORIZACION_NODOS), AUTORIZACION_LEASE_SEG)
+
+
+def iniciar_autorizacion():
+    nodo_autorizacion.iniciar()
+
+
+def cerrar_autorizacion():
+    nodo_autorizacion.cerrar()
@@ -0,0 +1,189 @@
+# API_TARJETA_MULTI\core\cache.py
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional
+
+
+class _Entrada:
+    __slots__ = ("valor", "vence", "cargado", "tablas")
+
+    def __init__(self, valor, vence: float, cargado: float, tablas: frozenset):
+        self.valor = valor
+        self.vence = vence
+        self.cargado = cargado
+        self.tablas = tablas
+
+
+class _Vuelo:
+    __slots__ = ("listo", "valor", "error")
+
+    def __init__(self):
+        self.listo = threading.Event()
+        self.valor = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Agrupa ejecuciones simultáneas con la misma clave: la primera ejecuta `funcion()` y las
+    que llegan mientras tanto esperan y reciben el mismo resultado (o la misma excepción).
+    No guarda nada: apenas termina, la próxima llamada vuelve a ejecutar.
+    """
+
+    def __init__(self):
+        self._en_curso: Dict[Hashable, _Vuelo] = {}
+        self._lock = threading.Lock()
+        self.ejecutadas = 0
+        self.agrupadas = 0
+
+    def ejecutar(self, clave: Hashable, funcion: Callable[[], Any]) -> Any:
+        with self._lock:
+            vuelo = self._en_curso.get(clave)
+            if vuelo is None:
+                vuelo = self._en_curso[clave] = _Vuelo()
+                propio = True
+                self.ejecutadas += 1
+            else:
+                propio = False
+                self.agrupadas += 1
+
+        if not propio:
+            vuelo.listo.wait()
+            if vuelo.error is not None:
+                raise vuelo.error
+            return vuelo.valor
+
+        try:
+            vuelo.valor = funcion()
+            return vuelo.valor
+        except BaseException as e:
+            vuelo.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._en_curso[clave]
+            vuelo.listo.set()
+
+    def estadisticas(self) -> Dict:
+        with self._lock:
+            return {"en_curso": len(self._en_curso), "ejecutadas": self.ejecutadas, "agrupadas": self.agrupadas}
+
+
+class CacheTenant:
+    """
+    Cache en memoria por tenant, con vencimiento (TTL) y tope de entradas
+    (se descarta la usada menos recientemente, sin importar el tenant).
+    Cada entrada declara de qué tablas depende para poder invalidarla por tabla.
+    Cada tenant tiene un número de versión que aumenta con cada invalidación por tenant o tabla;
+    invalidar una sola clave solo afecta a las cargas en curso de esa clave (generación por clave).
+    Las cargas simultáneas de una misma clave (y versión) se hacen una sola vez; las de
+    llamadores que ya retienen una conexión (con_conexion=True) se agrupan aparte, para que
+    nunca esperen a una carga que necesita pedir una conexión al pool.
+    """
+
+    def __init__(self, ttl: float, max_entradas: int):
+        self.ttl = ttl
+        self.max_entradas = max(1, max_entradas)
+        self._datos: "OrderedDict[tuple, _Entrada]" = OrderedDict()
+        self._versiones: Dict[str, int] = {}
+        self._version_global = 0
+        # Cargas en curso por clave y su generación (solo mientras hay alguna carga de esa clave)
+        self._cargando: Dict[tuple, int] = {}
+        self._generaciones: Dict[tuple, int] = {}
+        self._lock = threading.Lock()
+        self._vuelos = SingleFlight()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, cuit: str, clave: Hashable, cargar: Callable[[], Any],
+                tablas: Optional[Iterable[str]] = None, con_conexion: bool = False) -> Any:
+        """
+        Devuelve el valor en cache o lo carga con `cargar()` (read-through).
+        con_conexion=True indica que `cargar()` usa una conexión que el llamador ya tiene.
+        """
+        return self.obtener_con_edad(cuit, clave, cargar, tablas, con_conexion)[0]
+
+    def obtener_con_edad(self, cuit: str, clave: Hashable, cargar: Callable[[], Any],
+                         tablas: Optional[Iterable[str]] = None, con_conexion: bool = False):
+        """Igual que obtener(), pero devuelve (valor, segundos desde que se cargó)."""
+        k = (cuit, clave)
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._datos.get(k)
+            if entrada is not None and entrada.vence > ahora:
+                self._datos.move_to_end(k)
+                self.aciertos += 1
+                return entrada.valor, ahora - entrada.cargado
+            self.fallos += 1
+            version = self.version(cuit)
+            generacion = self._generaciones.get(k, 0)
+            self._cargando[k] = self._cargando.get(k, 0) + 1
+
+        try:
+            # Quien retiene una conexión no espera a una carga que puede quedar esperando al pool
+            # (el pool lleno de conexiones retenidas por quienes esperan): carga con la suya
+            valor = self._vuelos.ejecutar((k, version, generacion, con_conexion), cargar)
+
+            if tablas is None:
+                tablas = (clave[0] if isinstance(clave, tuple) else clave,)
+            ahora = time.monotonic()
+            with self._lock:
+                # Si se invalidó mientras se cargaba, el valor puede ser viejo: se devuelve pero no se guarda
+                if self.version(cuit) == version and self._generaciones.get(k, 0) == generacion:
+                    self._datos[k] = _Entrada(valor, ahora + self.ttl, ahora, frozenset(tablas))
+                    self._datos.move_to_end(k)
+                    while len(self._datos) > self.max_entradas:
+                        self._datos.popitem(last=False)
+            return valor, 0.0
+        finally:
+            with self._lock:
+                self._cargando[k] -= 1
+                if not self._cargando[k]:
+                    del self._cargando[k]
+                    self._generaciones.pop(k, None)
+
+    def invalidar(self, cuit: Optional[str] = None, tabla: Optional[str] = None,
+                  clave: Optional[Hashable] = None) -> int:
+        """
+        Invalida las entradas de un tenant (o de todos si cuit es None),
+        opcionalmente solo las que dependen de `tabla` o la de `clave`.
+        Devuelve la cantidad de entradas descartadas.
+        """
+        with self._lock:
+            if clave is not None and cuit is not None:
+                k = (cuit, clave)
+                borrar = [k] if k in self._datos else []
+                if borrar:
+                    del self._datos[k]
+                # Solo se descartan las cargas en curso de esta clave, no las del resto del tenant
+                if k in self._cargando:
+                    self._generaciones[k] = self._generaciones.get(k, 0) + 1
+                return len(borrar)
+            borrar = [
+                k for k, e in self._datos.items()
+                if (cuit is None or k[0] == cuit) and (tabla is None or tabla in e.tablas)
+            ]
+            for k in borrar:
+                del self._datos[k]
+            if cuit is None:
+                self._version_global += 1
+            else:
+                self._versiones[cuit] = self._versiones.get(cuit, 0) + 1
+            return len(borrar)
+
+    def version(self, cuit: str) -> int:
+        """Sello de versión del tenant: cambia cada vez que se invalida por tenant o por tabla."""
+        return self._version_global + self._versiones.get(cuit, 0)
+
+    def estadisticas(self) -> Dict:
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                "entradas": len(self._datos),
+                "max_entradas": self.max_entradas,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "ratio_aciertos": round(self.aciertos / consultas, 4) if consultas else 0.0,
+                "cargas_agrupadas": self._vuelos.agrupadas,
+            }
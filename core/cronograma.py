@@ -0,0 +1,113 @@
+# API_TARJETA_MULTI\core\cronograma.py
+# Cronograma de cuotas de una compra calculado en la API: importe (sistema francés, igual que
+# calcular_cuotas), liquidación (AAAAMM) y vencimiento según el calendario de la tarjeta.
+import calendar
+import re
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from core.amortizacion import valor_cuota
+from settings import CUOTAS_LOCAL, CUOTAS_CALENDARIOS, CUOTAS_AJUSTES
+
+
+def _leer_calendarios(texto: str) -> Dict[str, Tuple[int, int]]:
+    """"cuit:cierre:vencimiento,..." => {cuit: (dia_cierre, dia_vencimiento)}"""
+    calendarios = {}
+    for parte in filter(None, (p.strip() for p in texto.split(","))):
+        try:
+            cuit, cierre, vencimiento = (c.strip() for c in parte.split(":"))
+            cierre, vencimiento = int(cierre), int(vencimiento)
+        except ValueError:
+            raise ValueError(f"CUOTAS_CALENDARIOS inválido: {parte!r}")
+        if not (1 <= cierre <= 31 and 1 <= vencimiento <= 31):
+            raise ValueError(f"CUOTAS_CALENDARIOS inválido: {parte!r}")
+        calendarios[cuit] = (cierre, vencimiento)
+    return calendarios
+
+
+_CALENDARIOS = _leer_calendarios(CUOTAS_CALENDARIOS)
+
+if CUOTAS_AJUSTES and not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_.]*\.[A-Za-z_][A-Za-z0-9_]*", CUOTAS_AJUSTES):
+    raise ValueError(f"CUOTAS_AJUSTES inválido: {CUOTAS_AJUSTES!r}")
+
+
+def calendario_local(tenant: Dict) -> Optional[Tuple[int, int]]:
+    """
+    (dia_cierre, dia_vencimiento) del cliente si el cronograma se puede calcular en la API:
+    CUOTAS_LOCAL activo, calendario del cliente configurado y tabla de ajustes conocida.
+    None => usar DetalleCuotas_App.
+    """
+    if not CUOTAS_LOCAL or not CUOTAS_AJUSTES:
+        return None
+    return _CALENDARIOS.get(tenant["cuit"])
+
+
+def sql_tiene_ajustes(columna_compra: str) -> str:
+    """Expresión T-SQL (1/0) que indica si la compra de `columna_compra` tiene ajustes registrados."""
+    tabla, columna = CUOTAS_AJUSTES.rsplit(".", 1)
+    return f"CASE WHEN EXISTS (SELECT 1 FROM {tabla} WHERE {columna} = {columna_compra}) THEN 1 ELSE 0 END"
+
+
+def _sumar_meses(anio: int, mes: int, meses: int) -> Tuple[int, int]:
+    total = anio * 12 + (mes - 1) + meses
+    return total // 12, total % 12 + 1
+
+
+def _fecha_en_mes(anio: int, mes: int, dia: int) -> datetime:
+    """Día `dia` del mes, o el último día si el mes es más corto."""
+    return datetime(anio, mes, min(dia, calendar.monthrange(anio, mes)[1]))
+
+
+def primera_liquidacion(fecha: datetime, dia_cierre: int) -> Tuple[int, int]:
+    """(año, mes) de la liquidación donde entra la primera cuota: la del mes si la compra es hasta el cierre."""
+    if fecha.day <= dia_cierre:
+        return fecha.year, fecha.month
+    return _sumar_meses(fecha.year, fecha.month, 1)
+
+
+def cronograma_cuotas(fecha: datetime, importe: float, cuotas: int, factor: Optional[float],
+                      dia_cierre: int, dia_vencimiento: int) -> List[Dict]:
+    """
+    Cuotas de la compra como dicts (cuota, vencimento, importe, liquidacion), con las
+    mismas claves que Detalle_Cuotas. La cuota N se liquida N-1 meses después de la
+    primera y vence el `dia_vencimiento` del mes siguiente a su liquidación.
+    """
+    importe_cuota = valor_cuota(importe, cuotas, factor)
+    anio, mes = primera_liquidacion(fecha, dia_cierre)
+    resultado = []
+    for numero in range(1, cuotas + 1):
+        anio_liq, mes_liq = _sumar_meses(anio, mes, numero - 1)
+        anio_vto, mes_vto = _sumar_meses(anio_liq, mes_liq, 1)
+        resultado.append({
+            "cuota": numero,
+            "vencimento": _fecha_en_mes(anio_vto, mes_vto, dia_vencimiento),
+            "importe": importe_cuota,
+            "liquidacion": anio_liq * 100 + mes_liq,
+        })
+    return resultado
+
+
+def compromisos_mensuales(compras: Iterable[Tuple[datetime, float, int, Optional[float]]],
+                          desde: Tuple[int, int],
+                          dia_cierre: int,
+                          cuotas_sp: Iterable[Tuple[int, float]] = ()) -> Dict[int, float]:
+    """
+    Total por liquidación (AAAAMM) de las cuotas que se liquidan desde `desde` (año, mes)
+    en adelante. Cada compra es (fecha, importe, cuotas, factor); no se arma el cronograma
+    completo, solo se suma el importe de cuota en los meses pendientes. `cuotas_sp` son
+    cuotas ya resueltas por DetalleCuotas_App como (liquidacion, importe).
+    """
+    acumulado = defaultdict(float)
+    inicio = desde[0] * 12 + desde[1] - 1
+    for fecha, importe, cuotas, factor in compras:
+        anio, mes = primera_liquidacion(fecha, dia_cierre)
+        primera = anio * 12 + mes - 1
+        importe_cuota = valor_cuota(importe, cuotas, factor)
+        for indice in range(max(primera, inicio), primera + cuotas):
+            acumulado[(indice // 12) * 100 + indice % 12 + 1] += importe_cuota
+    periodo_inicio = desde[0] * 100 + desde[1]
+    for liquidacion, importe in cuotas_sp:
+        if liquidacion >= periodo_inicio:
+            acumulado[liquidacion] += importe
+    return {periodo: round(total, 2) for periodo, total in sorted(acumulado.items())}
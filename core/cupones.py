@@ -0,0 +1,96 @@
+# API_TARJETA_MULTI\core\cupones.py
+import threading
+from typing import Dict, Optional, Tuple
+
+import pyodbc
+
+from core.db_async import programar_db
+from core.pool import conexion_tenant
+from settings import CUPON_BLOQUE, CUPON_UMBRAL
+
+# Reserva atómica de un bloque: deja en Numeros el último número del bloque y lo devuelve
+_SQL_RESERVAR = "UPDATE Numeros SET cupon = cupon + ? OUTPUT inserted.cupon;"
+
+
+def reservar_bloque(conn: pyodbc.Connection, cantidad: int) -> Tuple[int, int]:
+    """Reserva `cantidad` números de cupón en una sola sentencia. Devuelve (primero, último)."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(_SQL_RESERVAR, cantidad)
+        ultimo = int(cursor.fetchone()[0])
+        if not conn.autocommit:
+            conn.commit()
+        return ultimo - cantidad + 1, ultimo
+    except Exception:
+        if not conn.autocommit:
+            conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+class AsignadorCupones:
+    """
+    Asignador hi/lo de números de cupón de un tenant.
+    Reserva bloques de `bloque` números en la tabla Numeros y los entrega desde memoria;
+    cuando quedan `umbral` números o menos, reserva el bloque siguiente en segundo plano.
+    Los números que queden sin usar al reiniciar el proceso se pierden (quedan huecos).
+    """
+
+    def __init__(self, tenant: Dict, bloque: int = CUPON_BLOQUE, umbral: int = CUPON_UMBRAL):
+        self.tenant = tenant
+        self.bloque = max(1, bloque)
+        self.umbral = umbral
+        self._siguiente = 1
+        self._fin = 0                                   # bloque actual vacío
+        self._proximo: Optional[Tuple[int, int]] = None  # bloque ya reservado en segundo plano
+        self._recargando = False
+        self._lock = threading.Lock()
+
+    def siguiente(self, conn: pyodbc.Connection) -> int:
+        with self._lock:
+            if self._siguiente > self._fin:
+                if self._proximo is not None:
+                    (self._siguiente, self._fin), self._proximo = self._proximo, None
+                else:
+                    # Sin bloque disponible: se reserva ahora con la conexión del request
+                    self._siguiente, self._fin = reservar_bloque(conn, self.bloque)
+            numero = self._siguiente
+            self._siguiente += 1
+            recargar = (
+                self.bloque > 1
+                and self._fin - numero <= self.umbral
+                and self._proximo is None
+                and not self._recargando
+            )
+            if recargar:
+                self._recargando = True
+        if recargar:
+            programar_db(self._recargar)
+        return numero
+
+    def _recargar(self):
+        try:
+            with conexion_tenant(self.tenant) as conn:
+                bloque = reservar_bloque(conn, self.bloque)
+            with self._lock:
+                self._proximo = bloque
+        except Exception:
+            # Si falla, el próximo request que agote el bloque reserva en línea
+            pass
+        finally:
+            with self._lock:
+                self._recargando = False
+
+
+_asignadores: Dict[Tuple[str, str], AsignadorCupones] = {}
+_asignadores_lock = threading.Lock()
+
+
+def get_asignador(tenant: Dict) -> AsignadorCupones:
+    clave = (tenant["cuit"], tenant["conn_str"])
+    asignador = _asignadores.get(clave)
+    if asignador is None:
+        with _asignadores_lock:
+            asignador = _asignadores.setdefault(clave, AsignadorCupones(tenant))
+    return asignador
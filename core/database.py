@@ -2,9 +2,13 @@
 import pyodbc
 from fastapi import HTTPException, status
 from models.archivos import ClienteConfig  # Importas el modelo existente
-from typing import Optional
+from typing import Dict, List, Optional
 import os
+import threading
+import time
 from dotenv import load_dotenv
+from settings import TENANTS_REFRESH_SEG, TENANTS_NEG_TTL_SEG
+from core.metricas import medir
 
 # Carga variables de entorno (opcional, pero recomendado)
 load_dotenv()
@@ -18,43 +22,124 @@ MASTER_DB_CONFIG = {
     "password": os.getenv("DB_MASTER_PASSWORD", "tu_pass")
 }
 
-def get_cliente_config(cuit: str) -> ClienteConfig:
-    """Obtiene configuración del cliente desde la DB maestra."""
+_SELECT_CLIENTES = (
+    "SELECT id, cuit, cliente, server, data_base, user_db, pass_udb, driver_odbc, token_acceso, activo "
+    "FROM clientes WHERE activo = 1"
+)
+
+
+def _master_conn_str() -> str:
+    return (
+        f"Driver={MASTER_DB_CONFIG['driver']};"
+        f"Server={MASTER_DB_CONFIG['server']};"
+        f"Database={MASTER_DB_CONFIG['database']};"
+        f"UID={MASTER_DB_CONFIG['user']};"
+        f"PWD={MASTER_DB_CONFIG['password']};"
+    )
+
+
+def leer_clientes(cuit: Optional[str] = None) -> List[ClienteConfig]:
+    """Lee de la DB maestra los clientes activos (todos, o solo el del CUIT indicado)."""
     try:
-        master_conn_str = (
-            f"Driver={MASTER_DB_CONFIG['driver']};"
-            f"Server={MASTER_DB_CONFIG['server']};"
-            f"Database={MASTER_DB_CONFIG['database']};"
-            f"UID={MASTER_DB_CONFIG['user']};"
-            f"PWD={MASTER_DB_CONFIG['password']};"
-        )
-        
-        with pyodbc.connect(master_conn_str) as conn:
+        with pyodbc.connect(_master_conn_str()) as conn:
             cursor = conn.cursor()
-            cursor.execute(
-                "SELECT id, cuit, cliente, server, data_base, user_db, pass_udb, driver_odbc, token_acceso, activo "
-                "FROM clientes WHERE cuit = ? AND activo = 1",
-                cuit
-            )
-            row = cursor.fetchone()
-            
-            if not row:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="Cliente no registrado o inactivo"
-                )
-                
-            # Convertir fila a diccionario (asumiendo que ClienteConfig en models/archivos.py tiene los mismos campos)
+            if cuit is None:
+                cursor.execute(_SELECT_CLIENTES)
+            else:
+                cursor.execute(_SELECT_CLIENTES + " AND cuit = ?", cuit)
             columns = [column[0] for column in cursor.description]
-            cliente_data = dict(zip(columns, row))
-            return ClienteConfig(**cliente_data)
-    
+            return [ClienteConfig(**dict(zip(columns, row))) for row in cursor.fetchall()]
+
     except pyodbc.Error as e:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail=f"Error al conectar a la DB maestra: {str(e)}"
         )
 
+
+class RegistroClientes:
+    """
+    Registro en memoria de los clientes activos de la DB maestra.
+    - Se carga completo al iniciar y se recarga cada `intervalo` segundos (en segundo plano).
+    - Un CUIT que no está en memoria se busca puntualmente (alta reciente) y, si no existe,
+      se recuerda como desconocido durante `ttl_negativo` segundos.
+    """
+
+    def __init__(self, intervalo: float, ttl_negativo: float, max_desconocidos: int = 10000):
+        self.intervalo = intervalo
+        self.ttl_negativo = ttl_negativo
+        self.max_desconocidos = max_desconocidos
+        self._clientes: Dict[str, ClienteConfig] = {}
+        self._desconocidos: Dict[str, float] = {}
+        self._cargado = 0.0        # momento de la última carga completa (0 = nunca)
+        self._lock = threading.Lock()
+        self._recargando = False
+
+    def cargar(self) -> int:
+        """Recarga completa desde la DB maestra. Devuelve la cantidad de clientes activos."""
+        clientes = {c.cuit: c for c in leer_clientes()}
+        with self._lock:
+            self._clientes = clientes
+            self._desconocidos = {}
+            self._cargado = time.monotonic()
+        return len(clientes)
+
+    def _recargar_en_segundo_plano(self):
+        try:
+            self.cargar()
+        except HTTPException:
+            # DB maestra no disponible: se sigue sirviendo lo que hay y se reintenta en el próximo intervalo
+            with self._lock:
+                self._cargado = time.monotonic()
+        finally:
+            with self._lock:
+                self._recargando = False
+
+    def _refrescar_si_vencido(self):
+        if not self._cargado:
+            self.cargar()
+            return
+        if time.monotonic() - self._cargado < self.intervalo:
+            return
+        with self._lock:
+            if self._recargando:
+                return
+            self._recargando = True
+        threading.Thread(target=self._recargar_en_segundo_plano, daemon=True).start()
+
+    def obtener(self, cuit: str) -> ClienteConfig:
+        self._refrescar_si_vencido()
+        cliente = self._clientes.get(cuit)
+        if cliente is not None:
+            return cliente
+
+        vence = self._desconocidos.get(cuit)
+        if vence is None or vence < time.monotonic():
+            # Puede ser un cliente dado de alta después de la última carga
+            encontrados = leer_clientes(cuit)
+            with self._lock:
+                if encontrados:
+                    self._desconocidos.pop(cuit, None)
+                    self._clientes = {**self._clientes, cuit: encontrados[0]}
+                    return encontrados[0]
+                if len(self._desconocidos) >= self.max_desconocidos:
+                    self._desconocidos.clear()
+                self._desconocidos[cuit] = time.monotonic() + self.ttl_negativo
+
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Cliente no registrado o inactivo"
+        )
+
+
+registro_clientes = RegistroClientes(TENANTS_REFRESH_SEG, TENANTS_NEG_TTL_SEG)
+
+
+def get_cliente_config(cuit: str) -> ClienteConfig:
+    """Obtiene configuración del cliente (registro en memoria de la DB maestra)."""
+    with medir("maestra"):
+        return registro_clientes.obtener(cuit)
+
 def get_db_connection(cliente: ClienteConfig) -> pyodbc.Connection:
     """Conecta a la base de datos específica del cliente."""
     try:
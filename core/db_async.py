@@ -0,0 +1,28 @@
+# API_TARJETA_MULTI\core\db_async.py
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from settings import DB_THREADS
+
+# Pool de hilos dedicado a las llamadas bloqueantes de pyodbc (acotado por DB_THREADS).
+# pyodbc libera el GIL mientras espera al servidor, así que los hilos no compiten entre sí.
+_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="db")
+
+
+async def ejecutar_db(func: Callable, *args, **kwargs) -> Any:
+    """Ejecuta `func(*args, **kwargs)` en el pool de hilos de BD sin bloquear el event loop."""
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, functools.partial(ctx.run, func, *args, **kwargs))
+
+
+def programar_db(func: Callable, *args, **kwargs):
+    """Encola `func` en el pool de hilos de BD sin esperar el resultado (tareas de fondo)."""
+    return _executor.submit(func, *args, **kwargs)
+
+
+def cerrar_executor():
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,268 @@
+# API_TARJETA_MULTI\core\idempotencia.py
+# Header Idempotency-Key en las grabaciones de compras: un reintento con la misma clave
+# devuelve la respuesta ya generada en lugar de volver a grabar, y los duplicados que llegan
+# mientras la primera ejecución está en curso esperan su resultado.
+# La conexión del request se pide al pool recién cuando hace falta (la operación o la tabla
+# durable): las repeticiones y los duplicados en espera no ocupan una conexión.
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Optional
+
+import pyodbc
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from core.db_async import ejecutar_db
+from settings import IDEMPOTENCIA_TTL_SEG, IDEMPOTENCIA_MAX, IDEMPOTENCIA_TABLA
+
+MAX_LARGO_CLAVE = 100
+HEADER_REPETIDA = "Idempotent-Replayed"
+
+# Resultado que queda guardado si la operación falló o se canceló después de enviar la grabación:
+# no se sabe si la compra se grabó, así que la clave no se libera (un reintento podría cobrar dos veces)
+RESULTADO_DESCONOCIDO = (409, {
+    "detail": "La grabación con esta Idempotency-Key terminó con resultado desconocido: "
+              "verifique la compra antes de reintentar con otra clave"
+})
+
+if IDEMPOTENCIA_TABLA and not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_.]*", IDEMPOTENCIA_TABLA):
+    raise ValueError(f"IDEMPOTENCIA_TABLA inválida: {IDEMPOTENCIA_TABLA!r}")
+
+
+class _Registro:
+    __slots__ = ("huella", "futuro", "vence")
+
+    def __init__(self, huella: str, futuro: asyncio.Future, vence: float):
+        self.huella = huella
+        self.futuro = futuro        # resultado: (status, cuerpo)
+        self.vence = vence
+
+
+class Intento:
+    """La operación llama a enviar() justo antes de mandar la grabación a la BD."""
+    __slots__ = ("enviado",)
+
+    def __init__(self):
+        self.enviado = False
+
+    def enviar(self):
+        self.enviado = True
+
+
+def huella_cuerpo(cuerpo: BaseModel) -> str:
+    """Huella del cuerpo del request: la misma clave con otro cuerpo es un error del cliente."""
+    return hashlib.blake2b(cuerpo.model_dump_json().encode("utf-8"), digest_size=16).hexdigest()
+
+
+# -- Tabla durable opcional (IDEMPOTENCIA_TABLA) en la BD del tenant:
+# CREATE TABLE ApiIdempotencia (clave NVARCHAR(100), endpoint NVARCHAR(50), huella CHAR(32),
+#     status INT NULL, respuesta NVARCHAR(MAX) NULL, creado DATETIME2 DEFAULT SYSDATETIME(),
+#     PRIMARY KEY (clave, endpoint));
+# La clave se reserva (fila con status NULL) antes de grabar: si otro worker ya la reservó, la
+# clave primaria lo impide y se responde con lo guardado, o 409 mientras siga en curso.
+# Se usa la conexión del request (autocommit solo durante estas sentencias).
+# Una reserva que queda con status NULL (proceso caído o request cancelado durante la grabación)
+# responde 409 hasta que alguien verifique la compra y borre la fila.
+@contextmanager
+def _cursor_autocommit(conn: pyodbc.Connection):
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    cursor = conn.cursor()
+    try:
+        yield cursor
+    finally:
+        cursor.close()
+        conn.autocommit = autocommit
+
+
+def _reservar_durable(conexion: Callable[[], pyodbc.Connection], endpoint: str, clave: str, huella: str):
+    """None si la clave quedó reservada; si ya existía, (huella, resultado o None si está en curso)."""
+    with _cursor_autocommit(conexion()) as cursor:
+        try:
+            cursor.execute(
+                f"INSERT INTO {IDEMPOTENCIA_TABLA} (clave, endpoint, huella) VALUES (?, ?, ?)",
+                clave, endpoint, huella
+            )
+            return None
+        except pyodbc.IntegrityError:
+            cursor.execute(
+                f"SELECT huella, status, respuesta FROM {IDEMPOTENCIA_TABLA} WHERE clave = ? AND endpoint = ?",
+                clave, endpoint
+            )
+            row = cursor.fetchone()
+    if row is None or row[1] is None:
+        # En curso en otro worker (o se liberó justo ahora): el cliente reintenta
+        return (row[0] if row else huella), None
+    return row[0], (int(row[1]), json.loads(row[2]))
+
+
+def _completar_durable(conexion: Callable[[], pyodbc.Connection], endpoint: str, clave: str, resultado: tuple):
+    with _cursor_autocommit(conexion()) as cursor:
+        cursor.execute(
+            f"UPDATE {IDEMPOTENCIA_TABLA} SET status = ?, respuesta = ? WHERE clave = ? AND endpoint = ?",
+            resultado[0], json.dumps(resultado[1], ensure_ascii=False), clave, endpoint
+        )
+
+
+def _liberar_durable(conexion: Callable[[], pyodbc.Connection], endpoint: str, clave: str):
+    with _cursor_autocommit(conexion()) as cursor:
+        cursor.execute(
+            f"DELETE FROM {IDEMPOTENCIA_TABLA} WHERE clave = ? AND endpoint = ? AND status IS NULL",
+            clave, endpoint
+        )
+
+
+class RegistroIdempotencia:
+    """
+    Respuestas por (tenant, endpoint, clave) con vencimiento y tope de entradas.
+    Se guardan los resultados exitosos y los rechazos 4xx. Un error 5xx antes de enviar la
+    grabación no se guarda, para que el cliente pueda reintentar; si ocurre después (o el request
+    se cancela) se guarda RESULTADO_DESCONOCIDO.
+    """
+
+    def __init__(self, ttl: float, max_entradas: int):
+        self.ttl = ttl
+        self.max_entradas = max(1, max_entradas)
+        self._datos: "OrderedDict[tuple, _Registro]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.repetidas = 0
+        self.coalescidas = 0
+
+    def _purgar(self, ahora: float):
+        # Todas las entradas tienen el mismo TTL: las más viejas están al principio
+        while self._datos:
+            k, registro = next(iter(self._datos.items()))
+            if registro.vence > ahora and len(self._datos) <= self.max_entradas:
+                break
+            del self._datos[k]
+
+    async def ejecutar(self, tenant: Dict, endpoint: str, clave: Optional[str], cuerpo: BaseModel,
+                       operacion: Callable[[Intento], Awaitable], conexion: Callable[[], pyodbc.Connection]):
+        """
+        Ejecuta `operacion(intento)` una sola vez por clave; sin clave la ejecuta siempre.
+        `conexion()` devuelve la conexión del request (la misma que usa la operación) para la
+        tabla durable; se llama desde el pool de hilos de BD y solo si hace falta.
+        """
+        if clave is None:
+            return await operacion(Intento())
+        clave = clave.strip()
+        if not clave or len(clave) > MAX_LARGO_CLAVE:
+            raise HTTPException(status_code=400, detail=f"Idempotency-Key debe tener entre 1 y {MAX_LARGO_CLAVE} caracteres")
+
+        huella = huella_cuerpo(cuerpo)
+        k = (tenant["cuit"], endpoint, clave)
+        ahora = time.monotonic()
+        with self._lock:
+            self._purgar(ahora)
+            registro = self._datos.get(k)
+            if registro is None:
+                registro = _Registro(huella, asyncio.get_running_loop().create_future(), ahora + self.ttl)
+                self._datos[k] = registro
+                propio = True
+            else:
+                propio = False
+                if registro.futuro.done():
+                    self.repetidas += 1
+                else:
+                    self.coalescidas += 1
+        if registro.huella != huella:
+            raise HTTPException(status_code=422, detail="Idempotency-Key ya usada con otro contenido")
+
+        if propio:
+            repetida = await self._resolver(registro, k, conexion, endpoint, clave, huella, operacion)
+            return self._respuesta(registro.futuro.result(), repetida=repetida)
+        status, cuerpo_respuesta = await asyncio.shield(registro.futuro)
+        return self._respuesta((status, cuerpo_respuesta), repetida=True)
+
+    async def _resolver(self, registro: _Registro, k: tuple, conexion: Callable[[], pyodbc.Connection],
+                        endpoint: str, clave: str, huella: str, operacion: Callable[[Intento], Awaitable]) -> bool:
+        """Resuelve el futuro del registro; devuelve True si el resultado ya estaba guardado."""
+        reservada = False
+        intento = Intento()
+        try:
+            if IDEMPOTENCIA_TABLA:
+                guardado = await ejecutar_db(_reservar_durable, conexion, endpoint, clave, huella)
+                if guardado is None:
+                    reservada = True
+                else:
+                    huella_guardada, resultado = guardado
+                    if huella_guardada != huella:
+                        raise HTTPException(status_code=422, detail="Idempotency-Key ya usada con otro contenido")
+                    if resultado is None:
+                        raise HTTPException(status_code=409, detail="Idempotency-Key en curso, reintente más tarde")
+                    registro.futuro.set_result(resultado)
+                    return True
+            try:
+                resultado = (200, jsonable_encoder(await operacion(intento)))
+            except HTTPException as e:
+                if e.status_code >= 500:
+                    raise
+                resultado = (e.status_code, {"detail": e.detail})
+            if reservada:
+                try:
+                    await ejecutar_db(_completar_durable, conexion, endpoint, clave, resultado)
+                except Exception:
+                    # La reserva queda en curso: los reintentos reciben 409, nunca una segunda grabación
+                    pass
+            registro.futuro.set_result(resultado)
+            return False
+        except asyncio.CancelledError:
+            # El hilo de BD puede seguir grabando con la conexión: no se la toca y la reserva
+            # queda en curso (409); los que esperaban y las repeticiones en memoria, desconocido
+            if not registro.futuro.done():
+                registro.futuro.set_result(RESULTADO_DESCONOCIDO)
+            raise
+        except Exception as e:
+            if intento.enviado:
+                # La grabación pudo haberse confirmado: la clave queda con resultado desconocido
+                if reservada:
+                    try:
+                        await ejecutar_db(_completar_durable, conexion, endpoint, clave, RESULTADO_DESCONOCIDO)
+                    except Exception:
+                        pass
+                registro.futuro.set_result(RESULTADO_DESCONOCIDO)
+                raise
+            # No se llegó a grabar: se libera la clave y los que esperaban reciben el mismo error
+            if reservada:
+                try:
+                    await ejecutar_db(_liberar_durable, conexion, endpoint, clave)
+                except Exception:
+                    pass
+            with self._lock:
+                if self._datos.get(k) is registro:
+                    del self._datos[k]
+            registro.futuro.set_exception(e)
+            registro.futuro.exception()   # marcada como leída si nadie esperaba
+            raise
+
+    @staticmethod
+    def _respuesta(resultado: tuple, repetida: bool):
+        status, cuerpo = resultado
+        if status >= 400:
+            raise HTTPException(status_code=status, detail=cuerpo.get("detail"),
+                                headers={HEADER_REPETIDA: "true"} if repetida else None)
+        if repetida:
+            return JSONResponse(content=cuerpo, status_code=status, headers={HEADER_REPETIDA: "true"})
+        return cuerpo
+
+    def estadisticas(self) -> Dict:
+        with self._lock:
+            en_curso = sum(1 for r in self._datos.values() if not r.futuro.done())
+            return {
+                "entradas": len(self._datos),
+                "en_curso": en_curso,
+                "max_entradas": self.max_entradas,
+                "repetidas": self.repetidas,
+                "coalescidas": self.coalescidas,
+            }
+
+
+registro_idempotencia = RegistroIdempotencia(IDEMPOTENCIA_TTL_SEG, IDEMPOTENCIA_MAX)
@@ -0,0 +1,55 @@
+# API_TARJETA_MULTI\core\limites.py
+# Límites de tarjetas (SP verLimites) con cache de vida corta por tenant.
+# Las grabaciones hechas por esta API invalidan la tarjeta afectada; los cambios hechos
+# por fuera (u otras tarjetas del mismo titular) se ven a lo sumo LIMITES_TTL_SEG después.
+from typing import Dict, Optional, Tuple
+
+import pyodbc
+
+from core.cache import CacheTenant
+from core.pool import conexion_tenant
+from settings import LIMITES_TTL_SEG, LIMITES_CACHE_MAX
+
+cache_limites = CacheTenant(LIMITES_TTL_SEG, LIMITES_CACHE_MAX)
+
+
+def _clave(numero_tarjeta) -> tuple:
+    numero = str(numero_tarjeta).strip()
+    return ("verLimites", str(int(numero)) if numero.isdigit() else numero)
+
+
+def leer_limites(conn: pyodbc.Connection, numero_tarjeta) -> Optional[Dict]:
+    """Ejecuta verLimites y devuelve la fila como diccionario (None si no hay límites)."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("exec verLimites ?", [numero_tarjeta])
+        row = cursor.fetchone()
+        if not row:
+            return None
+        return dict(zip([c[0] for c in cursor.description], row))
+    finally:
+        cursor.close()
+
+
+def limites_tarjeta(tenant: Dict, numero_tarjeta, conn: Optional[pyodbc.Connection] = None) -> Tuple[Optional[Dict], float]:
+    """
+    Límites de la tarjeta y antigüedad en segundos del dato.
+    Si no están en cache se leen con `conn` (o con una conexión del pool si no se pasa).
+    """
+    def cargar():
+        if conn is not None:
+            return leer_limites(conn, numero_tarjeta)
+        with conexion_tenant(tenant) as c:
+            return leer_limites(c, numero_tarjeta)
+    return cache_limites.obtener_con_edad(
+        tenant["cuit"], _clave(numero_tarjeta), cargar, con_conexion=conn is not None
+    )
+
+
+def invalidar_limites(tenant: Dict, numero_tarjeta):
+    cache_limites.invalidar(tenant["cuit"], clave=_clave(numero_tarjeta))
+
+
+def headers_antiguedad(edad: float) -> Dict[str, str]:
+    """Headers con la antigüedad del dato y la máxima posible (TTL del cache)."""
+    return {"Age": str(int(edad)), "X-Limites-Antiguedad-Max": str(int(LIMITES_TTL_SEG))}
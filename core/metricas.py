@@ -0,0 +1,229 @@
+# API_TARJETA_MULTI\core\metricas.py
+# Latencias por ruta y por tenant, separadas en fases (maestra, conexion, jwt, sql,
+# serializacion y otros, más el total), en histogramas log-lineales. Se exportan en formato Prometheus.
+import asyncio
+import functools
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Límites de los buckets (segundos): 1..9 por cada potencia de 10, de 0,1 ms a 10 s, más 20/30/60 s
+LIMITES: List[float] = [round(m * 10.0 ** e, 6) for e in range(-4, 1) for m in range(1, 10)] + [10.0, 20.0, 30.0, 60.0]
+
+
+class Histograma:
+    __slots__ = ("cuentas", "suma", "cantidad")
+
+    def __init__(self):
+        self.cuentas = [0] * (len(LIMITES) + 1)   # el último es +Inf
+        self.suma = 0.0
+        self.cantidad = 0
+
+    def registrar(self, segundos: float):
+        self.cuentas[bisect_left(LIMITES, segundos)] += 1
+        self.suma += segundos
+        self.cantidad += 1
+
+
+class _Fases:
+    """Tiempos acumulados de un request (compartido con los hilos que trabajan para él)."""
+    __slots__ = ("tiempos", "cuit", "fin_endpoint", "_lock")
+
+    def __init__(self):
+        self.tiempos: Dict[str, float] = {}
+        self.cuit: Optional[str] = None
+        self.fin_endpoint: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def sumar(self, fase: str, segundos: float):
+        with self._lock:
+            self.tiempos[fase] = self.tiempos.get(fase, 0.0) + segundos
+
+
+_fases_actuales: ContextVar[Optional[_Fases]] = ContextVar("metricas_fases", default=None)
+
+
+@contextmanager
+def medir(fase: str):
+    """Suma la duración del bloque a `fase` del request en curso (si lo hay)."""
+    fases = _fases_actuales.get()
+    if fases is None:
+        yield
+        return
+    inicio = perf_counter()
+    try:
+        yield
+    finally:
+        fases.sumar(fase, perf_counter() - inicio)
+
+
+def marcar_tenant(cuit: str):
+    """Etiqueta el request en curso con el CUIT del tenant (solo clientes ya validados)."""
+    fases = _fases_actuales.get()
+    if fases is not None:
+        fases.cuit = cuit
+
+
+class RegistroMetricas:
+    def __init__(self):
+        self._histogramas: Dict[Tuple[str, str, str], Histograma] = {}
+        self._respuestas: Dict[Tuple[str, str, int], int] = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, ruta: str, cuit: str, status: int, tiempos: Dict[str, float]):
+        with self._lock:
+            for fase, segundos in tiempos.items():
+                k = (ruta, cuit, fase)
+                histograma = self._histogramas.get(k)
+                if histograma is None:
+                    histograma = self._histogramas[k] = Histograma()
+                histograma.registrar(segundos)
+            k = (ruta, cuit, status)
+            self._respuestas[k] = self._respuestas.get(k, 0) + 1
+
+    def copia(self):
+        with self._lock:
+            histogramas = {
+                k: (list(h.cuentas), h.suma, h.cantidad) for k, h in self._histogramas.items()
+            }
+            return histogramas, dict(self._respuestas)
+
+
+registro_metricas = RegistroMetricas()
+
+
+class MiddlewareMetricas:
+    """Middleware ASGI: mide cada request HTTP y lo registra por ruta (plantilla), tenant y fase."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        fases = _Fases()
+        token = _fases_actuales.set(fases)
+        inicio = perf_counter()
+        estado = {"status": 500, "inicio_respuesta": None}
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                estado["status"] = mensaje["status"]
+                estado["inicio_respuesta"] = perf_counter()
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            _fases_actuales.reset(token)
+            total = perf_counter() - inicio
+            tiempos = dict(fases.tiempos)
+            # Desde que el endpoint devolvió hasta que empieza la respuesta: validación del
+            # response_model, armado de los modelos y codificación JSON
+            if fases.fin_endpoint is not None and estado["inicio_respuesta"] is not None:
+                tiempos["serializacion"] = max(0.0, estado["inicio_respuesta"] - fases.fin_endpoint)
+            tiempos["otros"] = max(0.0, total - sum(tiempos.values()))
+            tiempos["total"] = total
+            ruta = getattr(scope.get("route"), "path", None) or "sin_ruta"
+            registro_metricas.registrar(ruta, fases.cuit or "-", estado["status"], tiempos)
+
+
+def _marcar_fin_endpoint():
+    fases = _fases_actuales.get()
+    if fases is not None:
+        fases.fin_endpoint = perf_counter()
+
+
+def _envolver(funcion):
+    if asyncio.iscoroutinefunction(funcion):
+        @functools.wraps(funcion)
+        async def envuelta(*args, **kwargs):
+            try:
+                return await funcion(*args, **kwargs)
+            finally:
+                _marcar_fin_endpoint()
+    else:
+        @functools.wraps(funcion)
+        def envuelta(*args, **kwargs):
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                _marcar_fin_endpoint()
+    envuelta._instrumentada = True
+    return envuelta
+
+
+def instrumentar_rutas(rutas: Iterable):
+    """
+    Envuelve la función de cada endpoint para saber cuándo terminó (lo que sigue hasta la
+    respuesta es serialización). Se llama una vez, después de registrar todos los routers.
+    """
+    for ruta in rutas:
+        dependant = getattr(ruta, "dependant", None)
+        if dependant is None or getattr(dependant.call, "_instrumentada", False):
+            continue
+        dependant.call = _envolver(dependant.call)
+
+
+# -- Exportación en formato de texto de Prometheus
+def _etiquetas(**etiquetas) -> str:
+    partes = []
+    for nombre, valor in etiquetas.items():
+        valor = str(valor).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        partes.append(f'{nombre}="{valor}"')
+    return "{" + ",".join(partes) + "}"
+
+
+def _medidores(lineas: List[str], nombre: str, ayuda: str, valores: Dict[str, Dict], etiqueta: str):
+    """Un gauge por cada campo numérico de los diccionarios de `valores` (uno por `etiqueta`)."""
+    campos = sorted({c for d in valores.values() for c, v in d.items() if isinstance(v, (int, float))})
+    for campo in campos:
+        metrica = f"{nombre}_{campo}"
+        lineas.append(f"# HELP {metrica} {ayuda} ({campo})")
+        lineas.append(f"# TYPE {metrica} gauge")
+        for clave, datos in sorted(valores.items()):
+            valor = datos.get(campo)
+            if isinstance(valor, (int, float)):
+                lineas.append(f"{metrica}{_etiquetas(**{etiqueta: clave})} {valor}")
+
+
+def texto_prometheus(pools: Dict[str, Dict], caches: Dict[str, Dict], login: Dict) -> str:
+    histogramas, respuestas = registro_metricas.copia()
+    lineas = [
+        "# HELP api_request_duration_seconds Duración de los requests por ruta, tenant y fase",
+        "# TYPE api_request_duration_seconds histogram",
+    ]
+    for (ruta, cuit, fase), (cuentas, suma, cantidad) in sorted(histogramas.items()):
+        acumulado = 0
+        for limite, cuenta in zip(LIMITES, cuentas):
+            acumulado += cuenta
+            lineas.append(
+                f"api_request_duration_seconds_bucket{_etiquetas(ruta=ruta, cuit=cuit, fase=fase, le=limite)} {acumulado}"
+            )
+        lineas.append(
+            f"api_request_duration_seconds_bucket{_etiquetas(ruta=ruta, cuit=cuit, fase=fase, le='+Inf')} {cantidad}"
+        )
+        lineas.append(f"api_request_duration_seconds_sum{_etiquetas(ruta=ruta, cuit=cuit, fase=fase)} {suma}")
+        lineas.append(f"api_request_duration_seconds_count{_etiquetas(ruta=ruta, cuit=cuit, fase=fase)} {cantidad}")
+
+    lineas.append("# HELP api_requests_total Requests por ruta, tenant y status HTTP")
+    lineas.append("# TYPE api_requests_total counter")
+    for (ruta, cuit, status), cantidad in sorted(respuestas.items()):
+        lineas.append(f"api_requests_total{_etiquetas(ruta=ruta, cuit=cuit, status=status)} {cantidad}")
+
+    _medidores(lineas, "api_db_pool", "Pool de conexiones por tenant", pools, "cuit")
+    _medidores(lineas, "api_cache", "Caches en memoria", caches, "cache")
+    lineas.append("# HELP api_login_pendientes Verificaciones de contraseña en curso o en cola")
+    lineas.append("# TYPE api_login_pendientes gauge")
+    lineas.append(f"api_login_pendientes {login.get('pendientes', 0)}")
+    rechazos = login.get("rechazos", {})
+    if rechazos:
+        lineas.append("# HELP api_login_rechazos_total Verificaciones de contraseña rechazadas por saturación")
+        lineas.append("# TYPE api_login_rechazos_total counter")
+        for motivo, cantidad in sorted(rechazos.items()):
+            lineas.append(f"api_login_rechazos_total{_etiquetas(motivo=motivo)} {cantidad}")
+    return "\n".join(lineas) + "\n"
@@ -0,0 +1,289 @@
+# API_TARJETA_MULTI\core\pool.py
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import pyodbc
+from fastapi import HTTPException, status
+
+from core.metricas import medir
+from settings import DB_POOL_MIN, DB_POOL_MAX, DB_POOL_IDLE_SEG, DB_POOL_TIMEOUT_SEG, DB_POOL_PING_SEG
+
+
+class CursorMedido:
+    """Cursor pyodbc que suma a la fase "sql" de las métricas el tiempo de cada ejecución y lectura."""
+    __slots__ = ("_cursor",)
+
+    def __init__(self, cursor: pyodbc.Cursor):
+        object.__setattr__(self, "_cursor", cursor)
+
+    def __getattr__(self, nombre):
+        return getattr(self._cursor, nombre)
+
+    def __setattr__(self, nombre, valor):
+        setattr(self._cursor, nombre, valor)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._cursor.__exit__(exc_type, exc, tb)
+
+    def execute(self, *args, **kwargs):
+        with medir("sql"):
+            self._cursor.execute(*args, **kwargs)
+        return self
+
+    def executemany(self, *args, **kwargs):
+        with medir("sql"):
+            return self._cursor.executemany(*args, **kwargs)
+
+    def fetchone(self):
+        with medir("sql"):
+            return self._cursor.fetchone()
+
+    def fetchmany(self, *args):
+        with medir("sql"):
+            return self._cursor.fetchmany(*args)
+
+    def fetchall(self):
+        with medir("sql"):
+            return self._cursor.fetchall()
+
+    def nextset(self):
+        with medir("sql"):
+            return self._cursor.nextset()
+
+
+class ConexionPool:
+    """
+    Envoltorio de una conexión pyodbc prestada por el pool.
+    Se comporta como pyodbc.Connection, pero close() la devuelve al pool
+    en lugar de cerrarla (los routers existentes pueden seguir llamando a close()).
+    """
+    __slots__ = ("_conn", "_pool", "_devuelta")
+
+    def __init__(self, conn: pyodbc.Connection, pool: "PoolTenant"):
+        object.__setattr__(self, "_conn", conn)
+        object.__setattr__(self, "_pool", pool)
+        object.__setattr__(self, "_devuelta", False)
+
+    def __getattr__(self, nombre):
+        if self._devuelta:
+            raise pyodbc.ProgrammingError("La conexión ya fue devuelta al pool")
+        return getattr(self._conn, nombre)
+
+    def __setattr__(self, nombre, valor):
+        setattr(self._conn, nombre, valor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def cursor(self) -> CursorMedido:
+        if self._devuelta:
+            raise pyodbc.ProgrammingError("La conexión ya fue devuelta al pool")
+        return CursorMedido(self._conn.cursor())
+
+    def close(self):
+        if not self._devuelta:
+            object.__setattr__(self, "_devuelta", True)
+            self._pool.devolver(self._conn)
+
+
+class PoolTenant:
+    """Pool acotado de conexiones a la BD de un tenant (CUIT + conn_str)."""
+
+    def __init__(self, cuit: str, conn_str: str,
+                 minimo: int = DB_POOL_MIN, maximo: int = DB_POOL_MAX,
+                 inactividad: float = DB_POOL_IDLE_SEG, espera: float = DB_POOL_TIMEOUT_SEG,
+                 ping: float = DB_POOL_PING_SEG):
+        self.cuit = cuit
+        self.conn_str = conn_str
+        self.minimo = max(0, minimo)
+        self.maximo = max(1, maximo)
+        self.inactividad = inactividad
+        self.espera = espera
+        self.ping = ping
+        self._libres = deque()          # (conn, momento en que se devolvió)
+        self._abiertas = 0
+        self._cerrado = False
+        self._cond = threading.Condition()
+
+    # -- Estado (para diagnóstico)
+    def estado(self) -> Dict:
+        with self._cond:
+            return {
+                "abiertas": self._abiertas,
+                "libres": len(self._libres),
+                "en_uso": self._abiertas - len(self._libres),
+                "maximo": self.maximo,
+            }
+
+    def _conectar(self) -> pyodbc.Connection:
+        try:
+            return pyodbc.connect(self.conn_str)
+        except pyodbc.Error as e:
+            with self._cond:
+                self._abiertas -= 1
+                self._cond.notify()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=f"Error al conectar a la DB del cliente {self.cuit}: {str(e)}"
+            )
+
+    def _descartar(self, conn: pyodbc.Connection):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _sana(self, conn: pyodbc.Connection) -> bool:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _desalojar_inactivas(self) -> list:
+        """Quita (con el lock tomado) las conexiones libres que superaron el tiempo de inactividad."""
+        vencidas = []
+        limite = time.monotonic() - self.inactividad
+        while self._libres and self._abiertas > self.minimo and self._libres[0][1] < limite:
+            vencidas.append(self._libres.popleft()[0])
+            self._abiertas -= 1
+        return vencidas
+
+    def obtener(self) -> pyodbc.Connection:
+        """Presta una conexión: reutiliza una libre (verificada) o abre una nueva si hay cupo."""
+        fin = time.monotonic() + self.espera
+        while True:
+            conn = None
+            desde = 0.0
+            with self._cond:
+                if self._cerrado:
+                    raise HTTPException(status_code=503, detail="Pool de conexiones cerrado")
+                vencidas = self._desalojar_inactivas()
+                if self._libres:
+                    # LIFO: la más reciente tiene menos chances de haber sido cortada
+                    conn, desde = self._libres.pop()
+                elif self._abiertas < self.maximo:
+                    self._abiertas += 1
+                else:
+                    restante = fin - time.monotonic()
+                    if restante <= 0:
+                        raise HTTPException(
+                            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail=f"Sin conexiones disponibles para el cliente {self.cuit}"
+                        )
+                    self._cond.wait(restante)
+                    continue
+            for vieja in vencidas:
+                self._descartar(vieja)
+
+            if conn is None:
+                return self._conectar()
+            if time.monotonic() - desde < self.ping or self._sana(conn):
+                return conn
+            # Conexión caída: se descarta y se libera el cupo
+            self._descartar(conn)
+            with self._cond:
+                self._abiertas -= 1
+                self._cond.notify()
+
+    def devolver(self, conn: pyodbc.Connection):
+        """Devuelve la conexión al pool, descartando transacciones pendientes y restaurando autocommit."""
+        try:
+            if not conn.autocommit:
+                conn.rollback()
+            else:
+                conn.autocommit = False
+            reutilizable = True
+        except Exception:
+            reutilizable = False
+
+        with self._cond:
+            if reutilizable and not self._cerrado:
+                self._libres.append((conn, time.monotonic()))
+                conn = None
+            else:
+                self._abiertas -= 1
+            vencidas = self._desalojar_inactivas()
+            self._cond.notify()
+        if conn is not None:
+            self._descartar(conn)
+        for vieja in vencidas:
+            self._descartar(vieja)
+
+    def cerrar(self):
+        with self._cond:
+            self._cerrado = True
+            libres = [c for c, _ in self._libres]
+            self._abiertas -= len(libres)
+            self._libres.clear()
+            self._cond.notify_all()
+        for conn in libres:
+            self._descartar(conn)
+
+
+# -- Registro de pools por tenant
+_pools: Dict[str, PoolTenant] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(cuit: str, conn_str: str) -> PoolTenant:
+    """Pool del tenant; si cambió el conn_str (credenciales rotadas) se reemplaza el anterior."""
+    pool = _pools.get(cuit)
+    if pool is not None and pool.conn_str == conn_str:
+        return pool
+    anterior: Optional[PoolTenant] = None
+    with _pools_lock:
+        pool = _pools.get(cuit)
+        if pool is None or pool.conn_str != conn_str:
+            anterior = pool
+            pool = PoolTenant(cuit, conn_str)
+            _pools[cuit] = pool
+    if anterior is not None:
+        anterior.cerrar()
+    return pool
+
+
+def prestar_conexion(tenant: Dict) -> ConexionPool:
+    """Presta una conexión del pool del tenant; quien la pide debe llamar a close()."""
+    pool = get_pool(tenant["cuit"], tenant["conn_str"])
+    with medir("conexion"):
+        conn = pool.obtener()
+    return ConexionPool(conn, pool)
+
+
+@contextmanager
+def conexion_tenant(tenant: Dict):
+    """Presta una conexión del pool del tenant y garantiza su devolución."""
+    conn = prestar_conexion(tenant)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def estado_pools() -> Dict[str, Dict]:
+    return {cuit: pool.estado() for cuit, pool in list(_pools.items())}
+
+
+def cerrar_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.cerrar()
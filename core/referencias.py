@@ -0,0 +1,131 @@
+# API_TARJETA_MULTI\core\referencias.py
+# Tablas de referencia de cada tenant (tjEstados, tjPlanes, tjPlanComercio, tjCajaComercios)
+# leídas a través de un cache compartido por las consultas y por la grabación de compras.
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import pyodbc
+from pydantic import ValidationError
+
+from core.amortizacion import factor_amortizacion
+from core.cache import CacheTenant
+from core.pool import conexion_tenant
+from models.archivos import Estados, Planes, Planes_Comercios, Cajas_Comercio
+from settings import CACHE_REF_TTL_SEG, CACHE_REF_MAX
+
+cache_referencias = CacheTenant(CACHE_REF_TTL_SEG, CACHE_REF_MAX)
+
+
+def _consultar(conn: pyodbc.Connection, sentenciaSQL: str, params: tuple) -> list:
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sentenciaSQL, *params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def _leer(tenant: Dict, sentenciaSQL: str, *params, conn: Optional[pyodbc.Connection] = None) -> list:
+    """
+    Lee con `conn` si el llamador ya tiene una conexión del tenant (no se pide una segunda
+    al pool mientras se retiene la primera); si no, con una conexión prestada por el pool.
+    """
+    if conn is not None:
+        return _consultar(conn, sentenciaSQL, params)
+    with conexion_tenant(tenant) as c:
+        return _consultar(c, sentenciaSQL, params)
+
+
+class CatalogoPlanes:
+    """
+    Planes del tenant (tjPlanes) en el orden de la tabla, con acceso por id
+    y el factor de amortización de cada plan ya calculado (se renueva junto con el cache).
+    `reloj_bd` es el GETDATE() del servidor al cargar: ahora_bd() sigue ese reloj (no el de la API)
+    para comparar con el vencimiento de los planes.
+    """
+
+    def __init__(self, planes: List[Planes], reloj_bd: Optional[datetime] = None):
+        self.planes = planes
+        self.desfase = reloj_bd - datetime.now() if reloj_bd is not None else timedelta(0)
+        self.por_id: Dict[int, Planes] = {p.id: p for p in planes}
+        # Solo planes con cuotas; None = plan sin interés
+        self.factores: Dict[int, Optional[float]] = {
+            p.id: factor_amortizacion(p.interes, p.cuotas) for p in planes if p.cuotas > 0
+        }
+
+    def ahora_bd(self) -> datetime:
+        return datetime.now() + self.desfase
+
+
+def estados(tenant: Dict) -> List[Estados]:
+    def cargar():
+        return [Estados(id=row[0], nombre=row[1]) for row in _leer(tenant, 'SELECT id, nombre FROM tjEstados')]
+    return cache_referencias.obtener(tenant["cuit"], ("tjEstados",), cargar)
+
+
+def _plan_desde_fila(row) -> Optional[Planes]:
+    """Plan de la fila de tjPlanes, o None si le faltan datos (NULL en interes, costofin, vencimiento...)."""
+    try:
+        return Planes(
+            id = row[0],
+            nombre = row[1],
+            cuotas = row[2],
+            interes = row[3],
+            costofin = row[4],
+            vencimento = row[5],
+            activo = row[6]
+        )
+    except ValidationError:
+        return None
+
+
+def catalogo_planes(tenant: Dict, conn: Optional[pyodbc.Connection] = None) -> CatalogoPlanes:
+    """
+    Un plan con datos incompletos queda fuera del catálogo sin afectar a los demás:
+    las compras con ese plan calculan el importe de cuota en el lote de autorización.
+    """
+    def cargar():
+        filas = _leer(
+            tenant, 'SELECT id, nombre, cuotas, interes, costofin, vencimiento, activo, GETDATE() FROM tjPlanes',
+            conn=conn
+        )
+        return CatalogoPlanes(
+            [p for p in map(_plan_desde_fila, filas) if p is not None], filas[0][7] if filas else None
+        )
+    return cache_referencias.obtener(tenant["cuit"], ("tjPlanes",), cargar, con_conexion=conn is not None)
+
+
+def plan(tenant: Dict, id_plan: int, conn: Optional[pyodbc.Connection] = None) -> Optional[Planes]:
+    return catalogo_planes(tenant, conn).por_id.get(id_plan)
+
+
+def planes_de_comercio(tenant: Dict, id_comercio: int) -> List[Planes_Comercios]:
+    """
+    Planes habilitados del comercio que están activos y no vencidos según el reloj de la BD
+    (como el getdate() original). El vencimiento se controla en cada llamada: no guardar el resultado.
+    """
+    def cargar_ids():
+        return frozenset(row[0] for row in _leer(tenant, 'SELECT idPlan FROM tjPlanComercio WHERE idComercio = ?', id_comercio))
+
+    ids = cache_referencias.obtener(tenant["cuit"], ("tjPlanComercio", id_comercio), cargar_ids)
+    catalogo = catalogo_planes(tenant)
+    ahora = catalogo.ahora_bd()
+    return [
+        Planes_Comercios(id=p.id, nombre=p.nombre, cuotas=p.cuotas, interes=p.interes, costofin=p.costofin)
+        for p in catalogo.planes
+        if p.id in ids and p.activo and p.vencimento is not None and p.vencimento >= ahora
+    ]
+
+
+def cajas_de_comercio(tenant: Dict, id_comercio: int) -> List[Cajas_Comercio]:
+    def cargar():
+        return [
+            Cajas_Comercio(idCaja=row[0], idComercio=row[1], nombre_caja=row[2], fecha_creacion=row[3])
+            for row in _leer(tenant, 'SELECT * FROM tjCajaComercios where idComercio = ?', id_comercio)
+        ]
+    return cache_referencias.obtener(tenant["cuit"], ("tjCajaComercios", id_comercio), cargar)
+
+
+def invalidar(cuit: Optional[str] = None, tabla: Optional[str] = None) -> int:
+    """Descarta del cache las tablas de referencia de un tenant (o de todos)."""
+    return cache_referencias.invalidar(cuit, tabla)
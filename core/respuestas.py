@@ -0,0 +1,68 @@
+# API_TARJETA_MULTI\core\respuestas.py
+# Respuestas JSON pre-serializadas para endpoints de tablas de referencia, con ETag / 304.
+import hashlib
+from typing import Any, Callable, Dict, Hashable, Iterable
+
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+
+from core.referencias import cache_referencias
+
+CACHE_CONTROL = "private, no-cache"   # el cliente puede guardar la respuesta, pero revalida siempre con If-None-Match
+
+_adaptadores: Dict[Any, TypeAdapter] = {}
+
+
+class CuerpoJSON:
+    """Bytes de una respuesta JSON ya serializada, con su ETag (hash del contenido)."""
+    __slots__ = ("contenido", "etag")
+
+    def __init__(self, contenido: bytes):
+        self.contenido = contenido
+        self.etag = '"' + hashlib.blake2b(contenido, digest_size=16).hexdigest() + '"'
+
+
+def _adaptador(tipo) -> TypeAdapter:
+    adaptador = _adaptadores.get(tipo)
+    if adaptador is None:
+        adaptador = _adaptadores.setdefault(tipo, TypeAdapter(tipo))
+    return adaptador
+
+
+def coincide_etag(if_none_match: str, etag: str) -> bool:
+    for candidato in if_none_match.split(","):
+        candidato = candidato.strip()
+        if candidato.startswith("W/"):
+            candidato = candidato[2:]
+        if candidato == etag or candidato == "*":
+            return True
+    return False
+
+
+def respuesta_json_cacheada(request: Request, tenant: Dict, clave: Hashable, tipo,
+                            construir: Callable[[], Any], tablas: Iterable[str]) -> Response:
+    """
+    Devuelve el JSON de `construir()` (validado como `tipo`) guardando los bytes y su ETag
+    en el cache de referencias del tenant. Si el cliente manda If-None-Match con el mismo
+    ETag responde 304 sin consultar la BD ni serializar.
+    """
+    cuerpo = cache_referencias.obtener(
+        tenant["cuit"], ("json",) + tuple(clave),
+        lambda: CuerpoJSON(_adaptador(tipo).dump_json(construir())),
+        tablas=tablas,
+    )
+    return respuesta_con_etag(request, cuerpo)
+
+
+def respuesta_json(request: Request, tipo, valor: Any) -> Response:
+    """Como respuesta_json_cacheada, pero sin guardar nada: para respuestas que dependen de parámetros libres."""
+    return respuesta_con_etag(request, CuerpoJSON(_adaptador(tipo).dump_json(valor)))
+
+
+def respuesta_con_etag(request: Request, cuerpo: CuerpoJSON) -> Response:
+    """Response con el cuerpo ya serializado, o 304 si el If-None-Match del request coincide."""
+    headers = {"ETag": cuerpo.etag, "Cache-Control": CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and coincide_etag(if_none_match, cuerpo.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=cuerpo.contenido, media_type="application/json", headers=headers)
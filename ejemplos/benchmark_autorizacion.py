@@ -0,0 +1,41 @@
+'''
+Mide la velocidad del generador de códigos de autorización (core.autorizacion)
+y verifica que no se repitan: varios hilos en un proceso y varios procesos con nodos distintos.
+Cada nodo da a lo sumo POR_SEGUNDO códigos por segundo (más allá de MAX_ADELANTO segundos prestados, espera).
+Ejecutar desde la raíz del proyecto:  python -m ejemplos.benchmark_autorizacion
+'''
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from core.autorizacion import GeneradorAutorizacion, MAX_CODIGO
+
+CODIGOS_POR_HILO = 2000
+HILOS = 4
+PROCESOS = 4
+
+
+def generar(generador, cantidad):
+    return [generador.siguiente() for _ in range(cantidad)]
+
+
+def generar_en_proceso(nodo):
+    return generar(GeneradorAutorizacion(nodo), CODIGOS_POR_HILO)
+
+
+if __name__ == '__main__':
+    # Hilos de un mismo proceso compartiendo el generador
+    generador = GeneradorAutorizacion(1)
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(HILOS) as pool:
+        partes = list(pool.map(lambda _: generar(generador, CODIGOS_POR_HILO), range(HILOS)))
+    segundos = time.perf_counter() - inicio
+    codigos = [c for parte in partes for c in parte]
+    print(f"Hilos: {len(codigos)} códigos en {segundos:.3f}s ({len(codigos) / segundos:,.0f}/s), "
+          f"repetidos: {len(codigos) - len(set(codigos))}")
+    print("Ejemplo:", codigos[0], "máximo:", max(map(int, codigos)), "entra en INT:", max(map(int, codigos)) <= MAX_CODIGO)
+
+    # Procesos (workers) con nodos distintos
+    with ProcessPoolExecutor(PROCESOS) as pool:
+        partes = list(pool.map(generar_en_proceso, range(PROCESOS)))
+    codigos = [c for parte in partes for c in parte]
+    print(f"Procesos: {len(codigos)} códigos, repetidos: {len(codigos) - len(set(codigos))}")
@@ -1,27 +1,55 @@
 from fastapi import FastAPI, HTTPException, Depends, Request
 from tenants import require_tenant, resolve_tenant
-from auth import require_user
+from auth import require_user, require_admin
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.openapi.docs import get_swagger_ui_html
 from fastapi.openapi.utils import get_openapi
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse
 from dotenv import load_dotenv
 from routers.consultas import router as consultas_router
 from routers.calculos import router as calcular_cuotas
 from routers.grabaciones import router as grabaciones
 from routers.usuario import router as usuario_router
+from routers.multiples import router as multiples_router
 from routers.auth_login import router as auth_login_router
-from core.database import get_cliente_config
+from routers.admin import router as admin_router, router_metricas
+from core.database import get_cliente_config, registro_clientes
+from core.pool import cerrar_pools
+from core.db_async import cerrar_executor
+from core.autorizacion import iniciar_autorizacion, cerrar_autorizacion
+from security import cerrar_verificador
+from core.respuestas import CuerpoJSON, respuesta_con_etag
+from core.metricas import MiddlewareMetricas, instrumentar_rutas
+import json
+from contextlib import asynccontextmanager
 import os
 import time
 
-from typing import Annotated
+from typing import Annotated, Optional
 
 
 #-- Cargar las variables de entorno (ya no se usa TOKEN_ACESO global)
 load_dotenv()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Carga inicial de clientes; si la DB maestra no responde se reintenta en el primer request
+    try:
+        registro_clientes.cargar()
+    except HTTPException:
+        pass
+    # Nodo de los códigos de autorización (DB maestra); sin nodo las compras responden 503
+    iniciar_autorizacion()
+    yield
+    # Cierra las conexiones que quedaron en los pools de los tenants
+    cerrar_autorizacion()
+    cerrar_executor()
+    cerrar_verificador()
+    cerrar_pools()
+
+app = FastAPI(lifespan=lifespan)
+# Latencias por ruta, tenant y fase (ver GET /metrics)
+app.add_middleware(MiddlewareMetricas)
 security = HTTPBearer()
 app.title = "MAASoft - API Tarjetas de Compras"
 
@@ -39,7 +67,8 @@ def debug_token(user: dict = Depends(require_user)):
     }
 
 # -- Validar acceso solo si el token + CUIT coinciden
-async def validar_acceso_docs(
+# (sync: get_cliente_config usa el registro en memoria, pero un CUIT desconocido va a la DB maestra)
+def validar_acceso_docs(
     request: Request,
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
@@ -59,16 +88,28 @@ async def custom_swagger_ui_html():
     return get_swagger_ui_html(openapi_url="/openapi.json", title="Documentación")
 
 
+# El esquema se genera una sola vez (las rutas no cambian en ejecución) y se guarda serializado
+_openapi_cuerpo: Optional[CuerpoJSON] = None
+
+def openapi_serializado() -> CuerpoJSON:
+    global _openapi_cuerpo
+    if _openapi_cuerpo is None:
+        openapi_schema = get_openapi(
+            title="API Tarjetas de Compras",
+            version="1.0.0",
+            description="API para gestión de tarjetas y cálculos financieros",
+            routes=app.routes,
+            contact={"name": "MAASoft", "url": "http://maasoft.com.ar"},
+        )
+        _openapi_cuerpo = CuerpoJSON(
+            json.dumps(openapi_schema, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        )
+    return _openapi_cuerpo
+
+
 @app.get("/openapi.json", include_in_schema=False, dependencies=[Depends(validar_acceso_docs)])
-async def get_custom_openapi():
-    openapi_schema = get_openapi(
-        title="API Tarjetas de Compras",
-        version="1.0.0",
-        description="API para gestión de tarjetas y cálculos financieros",
-        routes=app.routes,
-        contact={"name": "MAASoft", "url": "http://maasoft.com.ar"},
-    )
-    return JSONResponse(openapi_schema)
+async def get_custom_openapi(request: Request):
+    return respuesta_con_etag(request, openapi_serializado())
 
 # Página de bienvenida
 @app.get('/', response_class=HTMLResponse, tags=['Inicio'])
@@ -108,6 +149,14 @@ app.include_router(consultas_router,  dependencies=[Depends(require_tenant), Dep
 app.include_router(calcular_cuotas,   dependencies=[Depends(require_tenant), Depends(require_user)])
 app.include_router(grabaciones,       dependencies=[Depends(require_tenant), Depends(require_user)])
 app.include_router(usuario_router,    dependencies=[Depends(require_tenant), Depends(require_user)])
+app.include_router(multiples_router,  dependencies=[Depends(require_tenant), Depends(require_user)])
+
+# -- Administración (protegida por X-Admin-Token)
+app.include_router(admin_router,      dependencies=[Depends(require_admin)])
+app.include_router(router_metricas,   dependencies=[Depends(require_admin)])
+
+# Marca el fin de cada endpoint para separar la serialización en las métricas
+instrumentar_rutas(app.routes)
 
 
 # -- Ejecución local (opcional)
@@ -1,7 +1,7 @@
 # API_TARJETA_MULTI\models\archivos.py
 from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import Optional
+from typing import Dict, List, Optional
 
 #-- Modelos Usuarios .NET 
 class AspNetUsers(BaseModel):
@@ -101,6 +101,16 @@ class Tarjetas(BaseModel):
 	baja: Optional[datetime]
 	vencimento: datetime
 
+# -- Consulta de varias Tarjetas
+class Tarjetas_Lote(BaseModel):
+	ids: List[int]
+
+# -- Cuotas pendientes de una Tarjeta por liquidación (AAAAMM => importe)
+class Compromisos_Tarjeta(BaseModel):
+	meses: Dict[int, float]
+	total: float
+	compras_sp: int = 0		# compras cuyas cuotas salieron de DetalleCuotas_App
+
 # -- Saldo Tarjetas
 class Saldo_Tarjeta(BaseModel):
 	id: int
@@ -119,6 +129,10 @@ class Compras(BaseModel):
 	autorizacion: Optional[int]
 	idcaja: Optional[int]
 
+# -- Compras en lote (terminales que acumulan ventas sin conexión)
+class Compras_Lote(BaseModel):
+	compras: List[Compras]
+
 # -- Cajas Comercios
 class Cajas_Comercio(BaseModel):
 	idCaja: int
@@ -152,3 +166,8 @@ class Operaciones_Comercio(BaseModel):
 	idplan: int
 	idCajaLotes: int
 	nombre_caja: str
+
+# -- Página de Operaciones por Comercio (paginado por cursor)
+class Pagina_Operaciones_Comercio(BaseModel):
+	operaciones: List[Operaciones_Comercio]
+	cursor: Optional[str]
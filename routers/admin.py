@@ -0,0 +1,65 @@
+# API_TARJETA_MULTI\routers\admin.py
+from typing import Optional
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from core.database import registro_clientes
+from core import referencias
+from auth import cache_tokens
+from core.idempotencia import registro_idempotencia
+from routers.consultas import lecturas_en_curso
+from core.limites import cache_limites
+from core.pool import estado_pools
+from core.metricas import texto_prometheus
+from security import estadisticas_password
+
+router = APIRouter(prefix="/_admin", tags=["admin"], include_in_schema=False)
+# /metrics va fuera del prefijo (ruta habitual de Prometheus), con la misma protección
+router_metricas = APIRouter(tags=["admin"], include_in_schema=False)
+
+
+# Recargar el registro de clientes desde la DB maestra (altas, bajas o cambios de credenciales)
+@router.post("/clientes/recargar")
+def recargar_clientes():
+    cantidad = registro_clientes.cargar()
+    return {"ok": True, "clientes": cantidad}
+
+
+# Invalidar el cache de tablas de referencia (tjPlanes, tjEstados, tjPlanComercio, tjCajaComercios)
+# de un cliente o de todos, completo o solo lo que depende de una tabla
+@router.post("/cache/invalidar")
+def invalidar_cache(cuit: Optional[str] = None, tabla: Optional[str] = None):
+    descartadas = referencias.invalidar(cuit, tabla)
+    version = referencias.cache_referencias.version(cuit) if cuit else None
+    return {"ok": True, "descartadas": descartadas, "version": version}
+
+
+@router.get("/cache")
+def estado_cache():
+    return {
+        "referencias": referencias.cache_referencias.estadisticas(),
+        "tokens": cache_tokens.estadisticas(),
+        "idempotencia": registro_idempotencia.estadisticas(),
+        "lecturas_agrupadas": lecturas_en_curso.estadisticas(),
+    }
+
+
+# Verificaciones de contraseña: pendientes, rechazos 429/503 y tiempos por versión de hash (v2/v3)
+@router.get("/login")
+def estado_login():
+    return estadisticas_password()
+
+
+# Latencias por ruta/tenant/fase, pools de conexiones y caches en formato de texto de Prometheus
+@router_metricas.get("/metrics", response_class=PlainTextResponse)
+def metricas():
+    caches = {
+        "referencias": referencias.cache_referencias.estadisticas(),
+        "limites": cache_limites.estadisticas(),
+        "tokens": cache_tokens.estadisticas(),
+        "idempotencia": registro_idempotencia.estadisticas(),
+        "lecturas": lecturas_en_curso.estadisticas(),
+    }
+    return PlainTextResponse(
+        texto_prometheus(estado_pools(), caches, estadisticas_password()),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
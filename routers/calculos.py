@@ -1,6 +1,11 @@
 # API_TARJETA_MULTI\routers\calculos.py
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends, Request
 from pydantic import BaseModel
+from typing import List
+from tenants import resolve_tenant
+from core.amortizacion import factor_amortizacion, valor_cuota
+from core import referencias
+from core.respuestas import respuesta_json
 
 router = APIRouter()
 
@@ -17,18 +22,28 @@ class ResultadoCuotas(BaseModel):
     cuotas: list
     total_compra: float
 
+# Varios cálculos en una llamada: listas del mismo largo (o de largo 1, que se repite para todos)
+class CuotasLoteInput(BaseModel):
+    montos: List[float]
+    tasas_interes_mensual: List[float]
+    cuotas: List[int]
+    detalle: bool = False   # incluir el cronograma (importe de cada cuota) de cada cálculo
+
+MAX_CALCULOS_LOTE = 10000
+
+# Resultado de simular un monto en un plan del comercio
+class SimulacionPlan(BaseModel):
+    id: int
+    nombre: str
+    cuotas: int
+    interes: float
+    costofin: float
+    monto_cuota: float
+    total_compra: float
+
 def calcular_cuotas(tarjeta: TarjetaInput):
-    m = 1
-    capital = tarjeta.monto
-    nTEM = tarjeta.tasa_interes_mensual / 100  # convertir tasa de porcentaje a decimal
-    nTEM = ((1 + nTEM) ** m) - 1
     cuotas = tarjeta.cuotas
-    if nTEM == 0:
-        nAmorti = 1
-        nValCta = capital * nAmorti / cuotas
-    else:
-        nAmorti = ((((1 + nTEM) ** cuotas) - 1) / (nTEM * (1 + nTEM) ** cuotas)) ** -1
-        nValCta = round(capital * nAmorti,2)
+    nValCta = valor_cuota(tarjeta.monto, cuotas, factor_amortizacion(tarjeta.tasa_interes_mensual, cuotas))
     
     cuotas_generadas = []
     for i in range(1, cuotas + 1):
@@ -37,6 +52,51 @@ def calcular_cuotas(tarjeta: TarjetaInput):
     total_compra = round(nValCta * cuotas,2)
     return ResultadoCuotas(cuotas=cuotas_generadas, total_compra=total_compra)
 
+def calcular_cuotas_lote(montos: List[float], tasas_interes_mensual: List[float], cuotas: List[int],
+                         detalle: bool = False) -> dict:
+    """
+    Calcula muchas combinaciones (monto, tasa, cuotas) de una vez y devuelve columnas:
+    monto_cuota[i], total_compra[i] y, si `detalle`, cronograma[i] (una lista por cálculo).
+    Los factores se calculan una sola vez por cada par (tasa, cuotas) distinto.
+    """
+    largo = max(len(montos), len(tasas_interes_mensual), len(cuotas))
+    columnas = []
+    for nombre, valores in (("montos", montos), ("tasas_interes_mensual", tasas_interes_mensual), ("cuotas", cuotas)):
+        if len(valores) not in (1, largo):
+            raise ValueError(f"'{nombre}' debe tener {largo} elementos o uno solo")
+        columnas.append(valores * largo if len(valores) == 1 else valores)
+    montos, tasas_interes_mensual, cuotas = columnas
+
+    factores = {par: factor_amortizacion(*par) for par in set(zip(tasas_interes_mensual, cuotas))}
+    monto_cuota = [
+        valor_cuota(m, n, factores[(t, n)])
+        for m, t, n in zip(montos, tasas_interes_mensual, cuotas)
+    ]
+    resultado = {
+        "monto_cuota": monto_cuota,
+        "total_compra": [round(v * n, 2) for v, n in zip(monto_cuota, cuotas)],
+    }
+    if detalle:
+        resultado["cronograma"] = [[v] * n for v, n in zip(monto_cuota, cuotas)]
+    return resultado
+
+def simular_planes(planes: list, monto: float) -> List[SimulacionPlan]:
+    """
+    Calcula cuota y total de `monto` en cada plan (mismo cálculo que calcular_cuotas)
+    y los ordena del menor total al mayor; a igual total, primero el de más cuotas.
+    """
+    cuotas = [p.cuotas for p in planes]
+    resultado = calcular_cuotas_lote([monto], [p.interes for p in planes], cuotas) if planes else None
+    simulaciones = [
+        SimulacionPlan(
+            id=p.id, nombre=p.nombre, cuotas=p.cuotas, interes=p.interes, costofin=p.costofin,
+            monto_cuota=resultado["monto_cuota"][i], total_compra=resultado["total_compra"][i],
+        )
+        for i, p in enumerate(planes)
+    ]
+    simulaciones.sort(key=lambda s: (s.total_compra, -s.cuotas))
+    return simulaciones
+
 @router.get("/calcular_cuotas/", tags=['Calculos'])
 async def calcular_cuotas_compra(monto: float, tasa_interes_mensual: float, cuotas: int):
     tarjeta = TarjetaInput(monto=monto, tasa_interes_mensual=tasa_interes_mensual, cuotas=cuotas)
@@ -54,3 +114,31 @@ async def calcular_cuotas_compra(tarjeta: TarjetaInput):
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+
+# Varios cálculos en una sola llamada (ej.: un carrito contra todos los planes), resultado en columnas
+@router.post("/calcular_cuotas/lote/", tags=['Calculos'])
+async def calcular_cuotas_lote_compra(lote: CuotasLoteInput):
+    if max(len(lote.montos), len(lote.tasas_interes_mensual), len(lote.cuotas)) > MAX_CALCULOS_LOTE:
+        raise HTTPException(status_code=400, detail=f"Máximo {MAX_CALCULOS_LOTE} cálculos por llamada")
+    try:
+        return calcular_cuotas_lote(lote.montos, lote.tasas_interes_mensual, lote.cuotas, lote.detalle)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+# Un monto contra todos los planes vigentes del comercio (reemplaza /planesComercios/ + un
+# /calcular_cuotas/ por plan). Los planes del comercio salen del cache de referencias; la
+# simulación se calcula en cada llamada (no se guarda una entrada por monto).
+@router.get("/simular_planes/", response_model=List[SimulacionPlan], tags=['Calculos'])
+def simular_planes_comercio(request: Request, id_comercio: int, monto: float,
+                            tenant: dict = Depends(resolve_tenant)):
+    if monto <= 0:
+        raise HTTPException(status_code=400, detail="El monto debe ser mayor a cero")
+    try:
+        return respuesta_json(
+            request, List[SimulacionPlan], simular_planes(referencias.planes_de_comercio(tenant, id_comercio), monto)
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al simular planes: {str(e)}")
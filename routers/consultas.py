@@ -1,9 +1,25 @@
 # API_TARJETA_MULTI\routers\consultas.py
 import pyodbc
-from fastapi import APIRouter, HTTPException, status, Depends
-from tenants import get_conn
-from typing import List
+import base64
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from decimal import Decimal
+from fastapi import APIRouter, HTTPException, status, Depends, Request, Response, Query
+from fastapi.responses import StreamingResponse
+from tenants import get_conn, get_conn_diferida, resolve_tenant, ConexionDiferida
+from core.pool import prestar_conexion
+from core.limites import limites_tarjeta, headers_antiguedad
+from core.cronograma import cronograma_cuotas, compromisos_mensuales, primera_liquidacion
+from core.cronograma import calendario_local, sql_tiene_ajustes
+from settings import EXPORT_FILAS_LOTE, COMPROMISOS_MAX_SP
+from typing import Dict, List, Optional
 from models.archivos import *
+from core import referencias
+from core.respuestas import respuesta_json_cacheada, respuesta_json
+from core.cache import SingleFlight
 
 
 router = APIRouter()
@@ -12,160 +28,112 @@ def get_client_connection(conn: pyodbc.Connection = Depends(get_conn)):
     return conn
 
 
+# Lecturas idénticas simultáneas de un tenant (mismo endpoint y parámetros) se ejecutan una sola
+# vez: las demás esperan el resultado de la primera en lugar de repetir la consulta en la BD.
+# Estos endpoints reciben una ConexionDiferida y piden la conexión dentro de `leer`, así que
+# las que esperan no ocupan una conexión del pool. Las que ya traen una conexión (lote de
+# /multiples/) se agrupan aparte: no esperan a una lectura que todavía tiene que pedirla al pool.
+lecturas_en_curso = SingleFlight()
+
+def leer_una_vez(tenant: dict, endpoint: str, params: tuple, leer, conn: ConexionDiferida):
+	return lecturas_en_curso.ejecutar((tenant["cuit"], endpoint, conn.retenida) + params, leer)
+
+
 
 # Leer todos los Estados 
+# (tablas de referencia: se sirven desde core.referencias, sin conexión si están en cache;
+#  los listados guardan el JSON ya serializado y responden 304 si coincide If-None-Match)
 @router.get('/estados', response_model=List[Estados], tags=['Estado de Tarjetas'])
-def leer_estados(conn: pyodbc.Connection = Depends(get_client_connection)):
-	estados_db = []
+def leer_estados(request: Request, tenant: dict = Depends(resolve_tenant)):
 	try:
-		with conn.cursor() as cursor:
-			sentenciaSQL = 'SELECT id, nombre FROM tjEstados'
-			cursor.execute(sentenciaSQL)
-			tabla = cursor.fetchall()
-			if tabla:
-				for row in tabla:
-					estado_list = Estados(
-						id = row[0],
-						nombre = row[1]
-					)
-					estados_db.append(estado_list)
+		return respuesta_json_cacheada(
+			request, tenant, ('estados',), List[Estados],
+			lambda: referencias.estados(tenant), tablas=('tjEstados',)
+		)
+	except HTTPException:
+		raise
 	except Exception as e:
 		raise HTTPException(
 			status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
 			detail="No se pudo establecer la conexión con el servidor!"
 		)
-	finally:
-		conn.close()
-	return estados_db
 
 
 # Buscar un Estados de Tarjeta segun su ID
 @router.get('/estados/', tags=['Estado de la Tarjeta'])
-def buscar_estado(id_estado: int, conn: pyodbc.Connection = Depends(get_client_connection)):
-	estado_db = None
+def buscar_estado(id_estado: int, tenant: dict = Depends(resolve_tenant)):
 	try:
-		with conn.cursor() as cursor:
-			sentenciaSQL = 'SELECT * FROM tjEstados WHERE id = ?'
-			cursor.execute(sentenciaSQL, id_estado)
-			registro = cursor.fetchone()
-			if registro:
-				estado_db = Estados(
-					id = registro[0],
-					nombre = registro[1]
-				)
-			else:
-				return {'mensaje': 'Estado No Encontrado'}
+		estado_db = next((e for e in referencias.estados(tenant) if e.id == id_estado), None)
+	except HTTPException:
+		raise
 	except Exception as e:
 		raise HTTPException(
 			status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
 			detail="No se pudo establecer la conexión con el servidor!"
 			)
-	finally:
-		conn.close()
+	if estado_db is None:
+		return {'mensaje': 'Estado No Encontrado'}
 	return estado_db
 
 
 # Leer todos los planes de pagos
 @router.get('/planes', response_model=List[Planes], tags=['Planes de pagos'])
-def leer_planes(conn: pyodbc.Connection = Depends(get_client_connection)):
-	planes_db = []
+def leer_planes(request: Request, tenant: dict = Depends(resolve_tenant)):
 	try:
-		with conn.cursor() as cursor:
-			sentenciaSQL = 'SELECT * FROM tjPlanes'
-			cursor.execute(sentenciaSQL)
-			plan = cursor.fetchall()
-			if plan:
-				for row in plan:
-					plan_list = Planes(
-						id = row[0],
-						nombre = row[1],
-						cuotas = row[2],
-						interes = row[3],
-						costofin = row[4],
-						vencimento = row[5],
-						activo = row[6]
-					)
-					planes_db.append(plan_list)
+		return respuesta_json_cacheada(
+			request, tenant, ('planes',), List[Planes],
+			lambda: referencias.catalogo_planes(tenant).planes, tablas=('tjPlanes',)
+		)
+	except HTTPException:
+		raise
 	except Exception as e:
 		raise HTTPException(
 			status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
 			detail="No se pudo establecer la conexión con el servidor!"
 		)
-	finally:
-		conn.close()
-	return planes_db
 
 
 # Buscar un plan de pagos segun su ID
 @router.get('/planes/', tags=['Plane de pago'])
-def buscar_plan(id_plan: int, conn: pyodbc.Connection = Depends(get_client_connection)):
-	planes_db = None
+def buscar_plan(id_plan: int, tenant: dict = Depends(resolve_tenant)):
 	try:
-		with conn.cursor() as cursor:
-			sentenciaSQL = 'SELECT * FROM tjPlanes WHERE id = ?'
-			cursor.execute(sentenciaSQL, id_plan)
-			plan = cursor.fetchone()
-			if plan:
-				planes_db = Planes(
-					id = plan[0],
-					nombre = plan[1],
-					cuotas = plan[2],
-					interes = plan[3],
-					costofin = plan[4],
-					vencimento = plan[5],
-					activo = plan[6]
-				)
-			else:
-				return {'mensaje': 'Plan No Encontrado'}
+		planes_db = referencias.plan(tenant, id_plan)
+	except HTTPException:
+		raise
 	except Exception as e:
 		raise HTTPException(
 			status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
 			detail="No se pudo establecer la conexión con el servidor!"
 		)
-	finally:
-		conn.close()
+	if planes_db is None:
+		return {'mensaje': 'Plan No Encontrado'}
 	return planes_db
 
 
 # Buscar los planes habilitados de un Comercio
+# (sin guardar el JSON: el vencimiento de los planes se controla en cada request; ETag igual)
 @router.get('/planesComercios/', response_model=List[Planes_Comercios], tags=['Planes de pagos de Comercios'])
-def planes_comercios(id_comercio: int, conn: pyodbc.Connection = Depends(get_client_connection)):
-	planes_db	= []
+def planes_comercios(request: Request, id_comercio: int, tenant: dict = Depends(resolve_tenant)):
 	try:
-		with conn.cursor() as cursor:
-			sentenciaSQL = '''
-						select * from tjPlanes where tjPlanes.id in 
-						(select idPlan from tjPlanComercio where idComercio=?) and tjPlanes.activo = 1 
-						and tjPlanes.vencimiento >= getdate()
-						'''
-			cursor.execute(sentenciaSQL, id_comercio)
-			registros = cursor.fetchall()
-			if registros:
-				for row in registros:
-					ultimas_compras_list = Planes_Comercios(
-						id = row[0],
-						nombre = row[1],
-						cuotas = row[2],
-						interes = row[3],
-						costofin = row[4]
-					)
-					planes_db.append(ultimas_compras_list)
+		return respuesta_json(
+			request, List[Planes_Comercios], referencias.planes_de_comercio(tenant, id_comercio)
+		)
+	except HTTPException:
+		raise
 	except Exception as e:
 		raise HTTPException(
 			status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
 			detail="No se pudo establecer la conexión con el servidor!"
 		)
-	finally:
-		conn.close()
-	return planes_db
 
 
 # Leer ultimas 5 compras con una tarjeta
 @router.get('/compras/', response_model=List[Ultimas_Compras], tags=['Registros de Compras'])
-def ultimas_compras(id_tarjeta: int = 'ID Tarjeta', conn: pyodbc.Connection = Depends(get_client_connection)):
-	ultimas_compras_db = []
-	try:
-		with conn.cursor() as cursor:
+def ultimas_compras(id_tarjeta: int = 'ID Tarjeta', conn: ConexionDiferida = Depends(get_conn_diferida),
+					tenant: dict = Depends(resolve_tenant)):
+	def leer():
+		ultimas_compras_db = []
+		with conn.obtener().cursor() as cursor:
 			sentenciaSQL = 'EXEC UltComprasSocios_App ?'
 			cursor.execute(sentenciaSQL, id_tarjeta)
 			compras = cursor.fetchall()
@@ -181,6 +149,9 @@ def ultimas_compras(id_tarjeta: int = 'ID Tarjeta', conn: pyodbc.Connection = De
 						id = row[6]
 					)
 					ultimas_compras_db.append(ultimas_compras_list)
+		return ultimas_compras_db
+	try:
+		ultimas_compras_db = leer_una_vez(tenant, '/compras/', (id_tarjeta,), leer, conn)
 	except Exception as e:
 		raise HTTPException(
 			status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -191,12 +162,52 @@ def ultimas_compras(id_tarjeta: int = 'ID Tarjeta', conn: pyodbc.Connection = De
 	return ultimas_compras_db
 
 
+# Cronograma de cuotas calculado en la API a partir de la compra (vwComprasAComercios), su plan
+# en cache y el calendario del cliente. Devuelve None si la compra tiene ajustes o no se puede
+# resolver la compra o el plan: en ese caso se usa el SP.
+def cuotas_locales(tenant: dict, conn: pyodbc.Connection, id_compra: int,
+				   calendario: tuple) -> Optional[List[Detalle_Cuotas]]:
+	cursor = conn.cursor()
+	try:
+		cursor.execute(
+			f'SELECT c.fecha, c.ImporteCompra, c.idplan, {sql_tiene_ajustes("c.IdOperacion")} '
+			'FROM vwComprasAComercios c WHERE c.IdOperacion = ?', id_compra
+		)
+		row = cursor.fetchone()
+	finally:
+		cursor.close()
+	if row is None or row[3] or row[0] is None or row[1] is None:
+		return None
+	catalogo = referencias.catalogo_planes(tenant, conn)
+	plan = catalogo.por_id.get(row[2])
+	if plan is None or plan.id not in catalogo.factores:
+		return None
+	dia_cierre, dia_vencimiento = calendario
+	return [
+		Detalle_Cuotas(**cuota)
+		for cuota in cronograma_cuotas(
+			row[0], float(row[1]), plan.cuotas, catalogo.factores[plan.id], dia_cierre, dia_vencimiento
+		)
+	]
+
+
 # Obtener las cuotas de una compra segun ID de Compras
+# (si el cliente tiene habilitado el cronograma local se calcula en la API sin ejecutar DetalleCuotas_App)
 @router.get('/cuotas/', response_model=List[Detalle_Cuotas], tags=['Detalle de Cuotas'])
-def detalle_cuotas(id_compra: int, conn: pyodbc.Connection = Depends(get_client_connection)):
-	detalle_cuotas_db = []
-	try:
-		with conn.cursor() as cursor:
+def detalle_cuotas(id_compra: int, tenant: dict = Depends(resolve_tenant),
+				   conn: ConexionDiferida = Depends(get_conn_diferida)):
+	calendario = calendario_local(tenant)
+	if calendario is not None:
+		try:
+			locales = cuotas_locales(tenant, conn.obtener(), id_compra, calendario)
+		except Exception:
+			locales = None   # ante cualquier problema se responde con el SP
+		if locales is not None:
+			conn.close()
+			return locales
+	def leer():
+		detalle_cuotas_db = []
+		with conn.obtener().cursor() as cursor:
 			sentenciaSQL = 'EXEC DetalleCuotas_App ?'
 			cursor.execute(sentenciaSQL, id_compra)
 			cuotas = cursor.fetchall()
@@ -209,6 +220,9 @@ def detalle_cuotas(id_compra: int, conn: pyodbc.Connection = Depends(get_client_
 						liquidacion = row[3]
 					)
 					detalle_cuotas_db.append(cuotas_list)
+		return detalle_cuotas_db
+	try:
+		detalle_cuotas_db = leer_una_vez(tenant, '/cuotas/', (id_compra,), leer, conn)
 	except Exception as e:
 		raise HTTPException(
 			status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -221,10 +235,11 @@ def detalle_cuotas(id_compra: int, conn: pyodbc.Connection = Depends(get_client_
 
 # Buscar un Comercio segun su ID
 @router.get('/comercios/', tags=['Informacion del Comercio'])
-def buscar_comercio(id_comercio: int, conn: pyodbc.Connection = Depends(get_client_connection)):
-	comercio_db = None
-	try:
-		with conn.cursor() as cursor:
+def buscar_comercio(id_comercio: int, conn: ConexionDiferida = Depends(get_conn_diferida),
+					tenant: dict = Depends(resolve_tenant)):
+	def leer():
+		comercio_db = None
+		with conn.obtener().cursor() as cursor:
 			sentenciaSQL = '''
 			SELECT id, pin, comercio, nombre, domicilio, localidad, provincia, mail, sucursal, socio, cuit
 				FROM tjComercios WHERE id = ?
@@ -245,6 +260,9 @@ def buscar_comercio(id_comercio: int, conn: pyodbc.Connection = Depends(get_clie
 					socio = registro[9],
 					cuit = registro[10]
 				)
+		return comercio_db
+	try:
+		comercio_db = leer_una_vez(tenant, '/comercios/', (id_comercio,), leer, conn)
 	except Exception as e:
 		raise HTTPException(
 			status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -257,30 +275,85 @@ def buscar_comercio(id_comercio: int, conn: pyodbc.Connection = Depends(get_clie
 
 # Buscar los cajas habilitados de un Comercio
 @router.get('/cajasComercios/', response_model=List[Cajas_Comercio], tags=['Cajas del Comercio'])
-def cajas_comercios(id_comercio: int, conn: pyodbc.Connection = Depends(get_client_connection)):
-	caja_db = []
+def cajas_comercios(request: Request, id_comercio: int, tenant: dict = Depends(resolve_tenant)):
 	try:
-		with conn.cursor() as cursor:
-			sentenciaSQL = 'SELECT * FROM tjCajaComercios where idComercio = ?'
-			cursor.execute(sentenciaSQL, (id_comercio,),)  # Agregar coma para formar tupla
-			registros = cursor.fetchall()
-			if registros:
-				for row in registros:
-					cajas_comercios_list = Cajas_Comercio(
-						idCaja=row[0],
-						idComercio=row[1],
-						nombre_caja=row[2],
-						fecha_creacion=row[3]
-					)
-					caja_db.append(cajas_comercios_list)
+		return respuesta_json_cacheada(
+			request, tenant, ('cajasComercios', id_comercio), List[Cajas_Comercio],
+			lambda: referencias.cajas_de_comercio(tenant, id_comercio), tablas=('tjCajaComercios',)
+		)
+	except HTTPException:
+		raise
 	except Exception as e:
 		raise HTTPException(
 			status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
 			detail=f"Error en la conexión: {str(e)}"  # Mostrar mensaje de error real
 		)
-	finally:
-		conn.close()
-	return caja_db
+
+
+# Columnas de vwComprasAComercios en el orden de Operaciones_Comercio
+COLUMNAS_OPERACIONES = '''IdOperacion, idtarjeta, TitularTarjeta, fecha, cupon, idcomercio, NombreComercio, 
+					   ImporteCompra, idplan, idCajaLotes, nombre_caja'''
+
+
+def operacion_desde_fila(row) -> Operaciones_Comercio:
+	return Operaciones_Comercio(
+		IdOperacion = row[0],
+		idtarjeta = row[1],
+		TitularTarjeta = row[2],
+		fecha = row[3],
+		cupon = row[4],
+		idcomercio = row[5],
+		NombreComercio = row[6],
+		ImporteCompra = row[7],
+		idplan = row[8],
+		idCajaLotes = row[9],
+		nombre_caja = row[10]
+	)
+
+
+def sql_operaciones_rango(id_comercio: int, desde: datetime, hasta: datetime,
+						  id_caja_lotes: Optional[int] = None, despues_de: Optional[tuple] = None,
+						  limite: Optional[int] = None):
+	"""
+	Arma la consulta de operaciones de un comercio en el rango [desde, hasta) ordenada por
+	(fecha, IdOperacion). `despues_de` = (fecha, IdOperacion) de la última fila ya entregada.
+	Devuelve (sentenciaSQL, parámetros).
+	"""
+	params = []
+	top = ''
+	if limite is not None:
+		top = 'TOP (?) '
+		params.append(limite)
+	sentenciaSQL = f'''
+		SELECT {top}{COLUMNAS_OPERACIONES}
+		FROM vwComprasAComercios
+		WHERE idcomercio = ? AND fecha >= ? AND fecha < ?
+	'''
+	params += [id_comercio, desde, hasta]
+	if id_caja_lotes is not None:
+		sentenciaSQL += ' AND idCajaLotes = ?'
+		params.append(id_caja_lotes)
+	if despues_de is not None:
+		# fecha es DATETIME en la vista: el valor del cursor se compara en ese mismo tipo
+		# (si llega como DATETIME2 la igualdad falla por la precisión de 1/300 s)
+		sentenciaSQL += ' AND (fecha > CAST(? AS DATETIME) OR (fecha = CAST(? AS DATETIME) AND IdOperacion > ?))'
+		params += [despues_de[0], despues_de[0], despues_de[1]]
+	sentenciaSQL += ' ORDER BY fecha, IdOperacion'
+	return sentenciaSQL, params
+
+
+def codificar_cursor(fecha: datetime, id_operacion: int) -> str:
+	crudo = json.dumps([fecha.isoformat(), id_operacion]).encode('utf-8')
+	return base64.urlsafe_b64encode(crudo).decode('ascii').rstrip('=')
+
+
+def decodificar_cursor(cursor: str) -> tuple:
+	try:
+		crudo = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+		fecha, id_operacion = json.loads(crudo)
+		return datetime.fromisoformat(fecha), int(id_operacion)
+	except Exception:
+		raise HTTPException(status_code=400, detail="Cursor inválido")
 
 
 # Buscar las Ventas de un Comercio segun su ID y fecha
@@ -288,36 +361,27 @@ def cajas_comercios(id_comercio: int, conn: pyodbc.Connection = Depends(get_clie
 def operaciones_comercio(
 	id_comercio: int,
 	fecha: str,  # formato 'YYYY-MM-DD'
-	conn: pyodbc.Connection = Depends(get_client_connection)
+	conn: ConexionDiferida = Depends(get_conn_diferida),
+	tenant: dict = Depends(resolve_tenant)
 ):
-	operaciones_db = []
-	try:
-		with conn.cursor() as cursor:
-			sentenciaSQL = '''
-				SELECT IdOperacion, idtarjeta, TitularTarjeta, fecha, cupon, idcomercio, NombreComercio, 
-					   ImporteCompra, idplan, idCajaLotes, nombre_caja
+	def leer():
+		operaciones_db = []
+		with conn.obtener().cursor() as cursor:
+			# Rango sobre fecha (no CAST de la columna) para poder usar el índice
+			sentenciaSQL = f'''
+				SELECT {COLUMNAS_OPERACIONES}
 				FROM vwComprasAComercios
-				WHERE idcomercio = ? AND CAST(fecha AS DATE) = ?
+				WHERE idcomercio = ? AND fecha >= CAST(? AS DATE) AND fecha < DATEADD(day, 1, CAST(? AS DATE))
 				ORDER BY NombreComercio DESC, idCajaLotes DESC
 			'''
-			cursor.execute(sentenciaSQL, id_comercio, fecha)
+			cursor.execute(sentenciaSQL, id_comercio, fecha, fecha)
 			registros = cursor.fetchall()
 			if registros:
 				for row in registros:
-					operacion = Operaciones_Comercio(
-						IdOperacion = row[0],
-						idtarjeta = row[1],
-						TitularTarjeta = row[2],
-						fecha = row[3],
-						cupon = row[4],
-						idcomercio = row[5],
-						NombreComercio = row[6],
-						ImporteCompra = row[7],
-						idplan = row[8],
-						idCajaLotes = row[9],
-						nombre_caja = row[10]
-					)
-					operaciones_db.append(operacion)
+					operaciones_db.append(operacion_desde_fila(row))
+		return operaciones_db
+	try:
+		operaciones_db = leer_una_vez(tenant, '/operacionesComercio/', (id_comercio, fecha), leer, conn)
 	except Exception as e:
 		raise HTTPException(
 			status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -328,12 +392,139 @@ def operaciones_comercio(
 	return operaciones_db
 
 
+# Buscar las Ventas de un Comercio en un rango de fechas, paginadas por cursor
+# (pasar el `cursor` devuelto para pedir la página siguiente; null = no hay más)
+@router.get('/operacionesComercio/rango/', response_model=Pagina_Operaciones_Comercio, tags=['Registros de Compras'])
+def operaciones_comercio_rango(
+	id_comercio: int,
+	desde: datetime,
+	hasta: datetime,  # no incluido
+	id_caja_lotes: Optional[int] = None,
+	limite: int = Query(100, ge=1, le=1000),
+	cursor: Optional[str] = None,
+	conn: pyodbc.Connection = Depends(get_client_connection)
+):
+	despues_de = decodificar_cursor(cursor) if cursor else None
+	operaciones_db = []
+	try:
+		with conn.cursor() as cur:
+			sentenciaSQL, params = sql_operaciones_rango(
+				id_comercio, desde, hasta, id_caja_lotes, despues_de, limite + 1
+			)
+			cur.execute(sentenciaSQL, params)
+			for row in cur.fetchall():
+				operaciones_db.append(operacion_desde_fila(row))
+	except Exception as e:
+		raise HTTPException(
+			status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+			detail=f"Error al consultar operaciones: {str(e)}"
+		)
+	finally:
+		conn.close()
+
+	siguiente = None
+	if len(operaciones_db) > limite:
+		operaciones_db = operaciones_db[:limite]
+		ultima = operaciones_db[-1]
+		siguiente = codificar_cursor(ultima.fecha, ultima.IdOperacion)
+	return Pagina_Operaciones_Comercio(operaciones=operaciones_db, cursor=siguiente)
+
+
+def _valor_exportable(valor, formato: str = 'ndjson'):
+	if isinstance(valor, datetime):
+		return valor.isoformat()
+	if isinstance(valor, Decimal):
+		# En CSV el importe va tal cual está en la BD; JSON no tiene decimales exactos
+		return str(valor) if formato == 'csv' else float(valor)
+	return valor
+
+
+def _generar_exportacion(conn, cur, formato: str, comprimir: bool):
+	"""Recorre el cursor de a EXPORT_FILAS_LOTE filas y va emitiendo NDJSON o CSV (opcionalmente gzip)."""
+	compresor = zlib.compressobj(wbits=31) if comprimir else None  # wbits=31 => formato gzip
+	try:
+		columnas = [c[0] for c in cur.description]
+		if formato == 'csv':
+			buffer = io.StringIO()
+			escritor = csv.writer(buffer)
+			escritor.writerow(columnas)
+			encabezado = buffer.getvalue().encode('utf-8')
+			buffer.seek(0)
+			buffer.truncate()
+			yield compresor.compress(encabezado) if compresor else encabezado
+		while True:
+			filas = cur.fetchmany(EXPORT_FILAS_LOTE)
+			if not filas:
+				break
+			if formato == 'csv':
+				escritor.writerows([[_valor_exportable(v, formato) for v in fila] for fila in filas])
+				bloque = buffer.getvalue().encode('utf-8')
+				buffer.seek(0)
+				buffer.truncate()
+			else:
+				bloque = ''.join(
+					json.dumps({c: _valor_exportable(v) for c, v in zip(columnas, fila)}, ensure_ascii=False) + '\n'
+					for fila in filas
+				).encode('utf-8')
+			yield compresor.compress(bloque) if compresor else bloque
+		if compresor:
+			yield compresor.flush()
+	finally:
+		cur.close()
+		conn.close()
+
+
+# Exportar las Ventas de un Comercio en un rango de fechas (NDJSON o CSV, opcionalmente gzip)
+# Se envía a medida que se lee: la memoria no depende del tamaño del rango.
+@router.get('/operacionesComercio/exportar/', tags=['Registros de Compras'])
+def exportar_operaciones_comercio(
+	id_comercio: int,
+	desde: datetime,
+	hasta: datetime,  # no incluido
+	id_caja_lotes: Optional[int] = None,
+	formato: str = Query('ndjson', pattern='^(ndjson|csv)$'),
+	gzip: bool = False,
+	tenant: dict = Depends(resolve_tenant)
+):
+	# La conexión se toma acá y la libera el generador al terminar de enviar
+	# (las dependencias con yield se cierran antes de que empiece el streaming)
+	conn = prestar_conexion(tenant)
+	try:
+		cur = conn.cursor()
+		sentenciaSQL, params = sql_operaciones_rango(id_comercio, desde, hasta, id_caja_lotes)
+		cur.execute(sentenciaSQL, params)
+	except Exception as e:
+		conn.close()
+		raise HTTPException(
+			status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+			detail=f"Error al consultar operaciones: {str(e)}"
+		)
+
+	nombre = f"operaciones_{id_comercio}_{desde:%Y%m%d}_{hasta:%Y%m%d}.{formato}"
+	media_type = 'text/csv; charset=utf-8' if formato == 'csv' else 'application/x-ndjson'
+	if gzip:
+		nombre += '.gz'
+		media_type = 'application/gzip'
+	return StreamingResponse(
+		_generar_exportacion(conn, cur, formato, gzip),
+		media_type=media_type,
+		headers={'Content-Disposition': f'attachment; filename="{nombre}"'}
+	)
+
+
 # Buscar una Tarjeta segun su ID
 @router.get('/tarjetas/', tags=['Tarjetas Asociados'])
-def buscar_tarjeta(id_tarjeta: int = 'ID Tarjeta', conn: pyodbc.Connection = Depends(get_client_connection)):
-	tarjeta_db = None
-	try:
-		with conn.cursor() as cursor:
+def buscar_tarjeta(
+	response: Response,
+	id_tarjeta: int = 'ID Tarjeta',
+	tenant: dict = Depends(resolve_tenant),
+	conn: ConexionDiferida = Depends(get_conn_diferida)
+):
+	def leer():
+		tarjeta_db, edad = None, None
+		conexion = conn.obtener()
+		cursor = conexion.cursor()
+		try:
 			sentenciaSQL = '''
 			SELECT id, sucursal, socio, adicional, verificador, nombre, domicilio, localidad, provincia, mail,
 				estado, baja, vencimiento 
@@ -341,28 +532,37 @@ def buscar_tarjeta(id_tarjeta: int = 'ID Tarjeta', conn: pyodbc.Connection = Dep
 			'''
 			cursor.execute(sentenciaSQL, id_tarjeta)
 			registro = cursor.fetchone()
-			if registro:
-				cursor.execute('EXEC verLimites ?', id_tarjeta)
-				limites = cursor.fetchone()
-				tarjeta_db = Tarjetas(
-					id = registro[0],
-					sucursal = registro[1],
-					socio = registro[2],
-					adicional = registro[3],
-					verificador = registro[4],
-					nombre = registro[5],
-					domicilio = registro[6],
-					localidad = registro[7],
-					provincia = registro[8],
-					mail = registro[9],
-					tope = limites[1] if limites else 0,
-					topemes = limites[2] if limites else 0,
-					saldo = limites[3] if limites else 0,
-					saldomes = limites[4] if limites else 0,
-					estado = registro[10],
-					baja = registro[11],
-					vencimento = registro[12]
-				)
+		finally:
+			# Sin MARS no se puede ejecutar verLimites con otro cursor mientras este tenga resultados
+			cursor.close()
+		if registro:
+			# verLimites pasa por el cache de límites (misma fila que devuelve el SP)
+			limites, edad = limites_tarjeta(tenant, id_tarjeta, conexion)
+			limites = list(limites.values()) if limites else None
+			tarjeta_db = Tarjetas(
+				id = registro[0],
+				sucursal = registro[1],
+				socio = registro[2],
+				adicional = registro[3],
+				verificador = registro[4],
+				nombre = registro[5],
+				domicilio = registro[6],
+				localidad = registro[7],
+				provincia = registro[8],
+				mail = registro[9],
+				tope = limites[1] if limites else 0,
+				topemes = limites[2] if limites else 0,
+				saldo = limites[3] if limites else 0,
+				saldomes = limites[4] if limites else 0,
+				estado = registro[10],
+				baja = registro[11],
+				vencimento = registro[12]
+			)
+		return tarjeta_db, edad
+	try:
+		tarjeta_db, edad = leer_una_vez(tenant, '/tarjetas/', (id_tarjeta,), leer, conn)
+		if edad is not None:
+			response.headers.update(headers_antiguedad(edad))
 	except Exception as e:
 		raise HTTPException(
 			status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -371,3 +571,132 @@ def buscar_tarjeta(id_tarjeta: int = 'ID Tarjeta', conn: pyodbc.Connection = Dep
 	finally:
 		conn.close()
 	return tarjeta_db
+
+
+# Buscar varias Tarjetas por ID con sus límites (una consulta por cada TARJETAS_POR_CONSULTA ids)
+# Los límites salen de tjLimites por el titular de la tarjeta, igual que la validación de compras.
+TARJETAS_POR_CONSULTA = 500
+MAX_TARJETAS_LOTE = 2000
+
+@router.post('/tarjetas/lote/', response_model=Dict[int, Tarjetas], tags=['Tarjetas Asociados'])
+def buscar_tarjetas_lote(lote: Tarjetas_Lote, conn: pyodbc.Connection = Depends(get_client_connection)):
+	ids = list(dict.fromkeys(lote.ids))
+	if len(ids) > MAX_TARJETAS_LOTE:
+		raise HTTPException(status_code=400, detail=f"Máximo {MAX_TARJETAS_LOTE} tarjetas por consulta")
+	tarjetas_db = {}
+	try:
+		with conn.cursor() as cursor:
+			for i in range(0, len(ids), TARJETAS_POR_CONSULTA):
+				parte = ids[i:i + TARJETAS_POR_CONSULTA]
+				sentenciaSQL = f'''
+				SELECT t.id, t.sucursal, t.socio, t.adicional, t.verificador, t.nombre, t.domicilio, t.localidad,
+					t.provincia, t.mail, t.estado, t.baja, t.vencimiento,
+					l.tope, l.topemes, l.saldo, l.saldomes
+				FROM tjTarjetas t LEFT JOIN tjLimites l ON l.idTarjeta = t.idtitular
+				WHERE t.id IN ({', '.join('?' * len(parte))})
+				'''
+				cursor.execute(sentenciaSQL, parte)
+				for registro in cursor.fetchall():
+					tarjetas_db[registro[0]] = Tarjetas(
+						id = registro[0],
+						sucursal = registro[1],
+						socio = registro[2],
+						adicional = registro[3],
+						verificador = registro[4],
+						nombre = registro[5],
+						domicilio = registro[6],
+						localidad = registro[7],
+						provincia = registro[8],
+						mail = registro[9],
+						tope = registro[13] or 0,
+						topemes = registro[14] or 0,
+						saldo = registro[15] or 0,
+						saldomes = registro[16] or 0,
+						estado = registro[10],
+						baja = registro[11],
+						vencimento = registro[12]
+					)
+	except Exception as e:
+		raise HTTPException(
+			status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+			detail="No se pudo establecer la conexión con el servidor!"
+		)
+	finally:
+		conn.close()
+	return tarjetas_db
+
+
+# Cuotas pendientes por liquidación de varias Tarjetas (reemplaza /compras/ + /cuotas/ por compra).
+# Una consulta por cada TARJETAS_POR_CONSULTA ids trae solo las compras que todavía pueden tener
+# cuotas pendientes (según el plan de más cuotas). Las cuotas se calculan en la API solo en los
+# mismos casos que /cuotas/ (cliente con calendario, compra sin ajustes y plan en cache); las
+# demás compras se resuelven con DetalleCuotas_App sobre la misma conexión, hasta COMPROMISOS_MAX_SP
+# por request: si hacen falta más se responde 413 sin ejecutar ninguna (sin calendario son todas).
+@router.post('/tarjetas/compromisos/', response_model=Dict[int, Compromisos_Tarjeta], tags=['Tarjetas Asociados'])
+def compromisos_tarjetas(lote: Tarjetas_Lote, tenant: dict = Depends(resolve_tenant),
+						 conn: pyodbc.Connection = Depends(get_client_connection)):
+	ids = list(dict.fromkeys(lote.ids))
+	if len(ids) > MAX_TARJETAS_LOTE:
+		raise HTTPException(status_code=400, detail=f"Máximo {MAX_TARJETAS_LOTE} tarjetas por consulta")
+	compras = {id_tarjeta: [] for id_tarjeta in ids}
+	cuotas_sp = {id_tarjeta: [] for id_tarjeta in ids}
+	por_sp = dict.fromkeys(ids, 0)
+	calendario = calendario_local(tenant)
+	ahora = datetime.now()
+	try:
+		catalogo = referencias.catalogo_planes(tenant, conn)
+		# Sin calendario del cliente se toma como pendiente desde la liquidación del mes en curso
+		anio, mes = primera_liquidacion(ahora, calendario[0]) if calendario else (ahora.year, ahora.month)
+		max_cuotas = max((p.cuotas for p in catalogo.planes), default=1)
+		indice = anio * 12 + mes - 1 - max_cuotas
+		desde = datetime(indice // 12, indice % 12 + 1, 1)
+		ajustes = sql_tiene_ajustes('c.IdOperacion') if calendario else '1'
+		por_operacion = []
+		cursor = conn.cursor()
+		try:
+			for i in range(0, len(ids), TARJETAS_POR_CONSULTA):
+				parte = ids[i:i + TARJETAS_POR_CONSULTA]
+				sentenciaSQL = f'''
+				SELECT c.idtarjeta, c.fecha, c.ImporteCompra, c.idplan, c.IdOperacion, {ajustes}
+				FROM vwComprasAComercios c
+				WHERE c.idtarjeta IN ({', '.join('?' * len(parte))}) AND c.fecha >= ?
+				'''
+				cursor.execute(sentenciaSQL, *parte, desde)
+				for registro in cursor.fetchall():
+					id_tarjeta, fecha, importe, id_plan, id_operacion, con_ajustes = registro
+					if con_ajustes or fecha is None or importe is None or id_plan not in catalogo.factores:
+						por_operacion.append((id_tarjeta, id_operacion))
+						continue
+					compras[id_tarjeta].append(
+						(fecha, float(importe), catalogo.por_id[id_plan].cuotas, catalogo.factores[id_plan])
+					)
+			if len(por_operacion) > COMPROMISOS_MAX_SP:
+				raise HTTPException(
+					status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+					detail=f"{len(por_operacion)} compras requieren DetalleCuotas_App (máximo {COMPROMISOS_MAX_SP}): "
+						   "consultar menos tarjetas por vez"
+				)
+			for id_tarjeta, id_operacion in por_operacion:
+				cursor.execute('EXEC DetalleCuotas_App ?', id_operacion)
+				cuotas_sp[id_tarjeta].extend((int(row[3]), float(row[2])) for row in cursor.fetchall())
+				por_sp[id_tarjeta] += 1
+		finally:
+			cursor.close()
+	except HTTPException:
+		raise
+	except Exception as e:
+		raise HTTPException(
+			status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+			detail="No se pudo establecer la conexión con el servidor!"
+		)
+	finally:
+		conn.close()
+
+	resultado = {}
+	dia_cierre = calendario[0] if calendario else 1	# sin calendario no hay compras calculadas en la API
+	for id_tarjeta in ids:
+		meses = compromisos_mensuales(compras[id_tarjeta], (anio, mes), dia_cierre, cuotas_sp[id_tarjeta])
+		resultado[id_tarjeta] = Compromisos_Tarjeta(
+			meses=meses, total=round(sum(meses.values()), 2), compras_sp=por_sp[id_tarjeta]
+		)
+	return resultado
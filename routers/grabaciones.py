@@ -1,96 +1,81 @@
 # API_TARJETA_MULTI\routers\grabaciones.py
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Response, Header
 from models.archivos import *
 from datetime import datetime
 import pyodbc
-from typing import Optional
-from tenants import get_conn 
-from .calculos import TarjetaInput, calcular_cuotas
+from typing import List, Optional
+from tenants import get_conn, get_conn_diferida, resolve_tenant, ConexionDiferida
+from core.db_async import ejecutar_db
+from core.cupones import get_asignador, reservar_bloque
+from core import referencias
+from core.limites import limites_tarjeta, invalidar_limites, headers_antiguedad
+from core.idempotencia import registro_idempotencia, Intento
+from core.autorizacion import generador_autorizacion
+from .calculos import valor_cuota
 
 router = APIRouter()
 
 
 def get_client_connection(conn: pyodbc.Connection = Depends(get_conn)):
+    # El pool devuelve las conexiones con autocommit=False y lo restaura al recibirlas
     conn.autocommit = False
     return conn
 
 
 # --- Funciones originales (iguales) ---
 def generar_codigo_autorizacion():
-    fecha_actual = datetime.now()
-    dia_juliano = fecha_actual.strftime("%j")
-    fecha_hora_actual = fecha_actual.strftime("%Y%m%d%H%M%S")
-    return dia_juliano + fecha_hora_actual[-6:]
+    # Numérico y dentro de INT como antes, con nodo y contador para que no se repita (core.autorizacion)
+    return generador_autorizacion.siguiente()
 
-async def obtener_nuevo_numero_cupon(conn: pyodbc.Connection):  # Ahora es async
+def obtener_nuevo_numero_cupon(conn: pyodbc.Connection, tenant: dict):  # bloqueante: llamar desde el pool de BD
+    # Los números salen de un bloque reservado en Numeros (core.cupones), no de un UPDATE por compra
     try:
-        cursor = conn.cursor()
-        cursor.execute('UPDATE Numeros SET cupon = cupon + 1;')
-        conn.commit()
-        cursor.execute('SELECT cupon FROM Numeros;')
-        return cursor.fetchone()[0]
+        return get_asignador(tenant).siguiente(conn)
     except Exception as e:
-        conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 
-def obtener_plan_info(conn: pyodbc.Connection, idplan: int):
+def obtener_plan_info(tenant: dict, idplan: int):
     """Obtiene la tasa de interés y la cantidad de cuotas para el plan `idplan`
-    desde la tabla tjPlanes. Lanza HTTPException si no puede obtener los datos.
+    desde el cache de tjPlanes. Lanza HTTPException si no puede obtener los datos.
     """
-    cursor = None
     try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT interes, cuotas FROM tjPlanes WHERE id = ?", [idplan])
-        row = cursor.fetchone()
-        
-        if row and row[0] is not None:
-            # Normalizar tipos
-            try:
-                tasa = float(row[0])
-            except Exception:
-                tasa = 0.0
-            try:
-                cuotas = int(row[1]) if row[1] is not None else 1
-            except Exception:
-                cuotas = 1
-            return tasa, cuotas
-        else:
-            raise HTTPException(status_code=400, detail=f"No se encontró información del plan para idplan={idplan}.")
-    
+        plan = referencias.plan(tenant, idplan)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error al obtener información del plan: {str(e)}")
-    finally:
-        if cursor:
-            cursor.close()
+
+    if plan is None or plan.interes is None:
+        raise HTTPException(status_code=400, detail=f"No se encontró información del plan para idplan={idplan}.")
+    return float(plan.interes), int(plan.cuotas) if plan.cuotas is not None else 1
 
 
-def obtener_limites_tarjeta(conn: pyodbc.Connection, numero_tarjeta: str):
-    """Llama al SP verLimites pasando el número de tarjeta y devuelve
-    los límites (totales y mensuales) como diccionario.
+def calcular_importe_cuota(tenant: dict, compra: Compras, conn: Optional[pyodbc.Connection] = None) -> Optional[float]:
+    """Importe de cuota de la compra según el plan en cache (None si el plan no está en cache).
+    Usa el factor precalculado del catálogo: es el mismo valor que daría calcular_cuotas.
+    Si hay que cargar los planes se usa `conn`, la conexión que ya tiene la compra.
+    """
+    catalogo = referencias.catalogo_planes(tenant, conn)
+    plan = catalogo.por_id.get(compra.idplan)
+    if plan is None:
+        return None
+    if plan.id not in catalogo.factores:
+        return 0.0
+    return float(valor_cuota(compra.importe, plan.cuotas, catalogo.factores[plan.id]))
+
+
+def obtener_limites_tarjeta(tenant: dict, numero_tarjeta: str):
+    """Devuelve los límites (totales y mensuales) de la tarjeta según el SP verLimites,
+    como diccionario, junto con la antigüedad en segundos del dato (cache de límites).
     """
-    cursor = None
     try:
-        cursor = conn.cursor()
-        cursor.execute("exec verLimites ?", [numero_tarjeta])
-        row = cursor.fetchone()
-        if not row:
-            raise HTTPException(status_code=404, detail=f"No se encontraron límites para tarjeta {numero_tarjeta}")
-        # Intentar mapear nombres de columnas si están disponibles
-        cols = [c[0] for c in cursor.description] if cursor.description else []
-        if cols:
-            return dict(zip(cols, row))
-        # si no hay descripción, devolver tupla
-        return {"result": row}
-    except HTTPException:
-        raise
+        limites, edad = limites_tarjeta(tenant, numero_tarjeta)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al obtener límites: {str(e)}")
-    finally:
-        if cursor:
-            cursor.close()
+    if not limites:
+        raise HTTPException(status_code=404, detail=f"No se encontraron límites para tarjeta {numero_tarjeta}")
+    return limites, edad
 
 
 def obtener_consumido_tarjeta(conn: pyodbc.Connection, numero_tarjeta: int):
@@ -120,34 +105,57 @@ def obtener_consumido_tarjeta(conn: pyodbc.Connection, numero_tarjeta: int):
             cursor.close()
 
 
+# Los endpoints async delegan el trabajo con pyodbc al pool de hilos de BD (core.db_async)
+# para no bloquear el event loop durante cada viaje a SQL Server.
 @router.get("/ver_limites/{numero_tarjeta}", tags=["Tarjetas"])
-async def ver_limites_endpoint(numero_tarjeta: str, conn: pyodbc.Connection = Depends(get_client_connection)):
-    return obtener_limites_tarjeta(conn, numero_tarjeta)
+async def ver_limites_endpoint(numero_tarjeta: str, response: Response, tenant: dict = Depends(resolve_tenant)):
+    # Sin conexión propia: si los límites están en cache no se toca la BD
+    limites, edad = await ejecutar_db(obtener_limites_tarjeta, tenant, numero_tarjeta)
+    response.headers.update(headers_antiguedad(edad))
+    return limites
 
 
 @router.get("/ver_consumido/{numero_tarjeta}", tags=["Tarjetas"])
 async def ver_consumido_endpoint(numero_tarjeta: int, conn: pyodbc.Connection = Depends(get_client_connection)):
-    return obtener_consumido_tarjeta(conn, numero_tarjeta)
+    return await ejecutar_db(obtener_consumido_tarjeta, conn, numero_tarjeta)
 
 
 # --- Endpoints adaptados ---
 # --- Grabar Compras de Tarjeta ---
+def _grabar_con_conexion(grabar, conn: ConexionDiferida, tenant: dict, compra: Compras, intento: Intento):
+    # La conexión se pide al pool recién acá (hilo de BD): las repeticiones no ocupan una
+    return grabar(conn.obtener(), tenant, compra, intento)
+
+
+# Con header Idempotency-Key, un reintento devuelve la respuesta original sin volver a grabar
 @router.post("/grabar_compra/", tags=['Registros de Compras'])
 async def grabar_compra_tarjeta(
     compra: Compras,
-    conn: pyodbc.Connection = Depends(get_client_connection)
+    tenant: dict = Depends(resolve_tenant),
+    conn: ConexionDiferida = Depends(get_conn_diferida),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
+    return await registro_idempotencia.ejecutar(
+        tenant, "grabar_compra", idempotency_key, compra,
+        lambda intento: ejecutar_db(_grabar_con_conexion, grabar_compra, conn, tenant, compra, intento),
+        conexion=conn.obtener
+    )
+
+
+def grabar_compra(conn: pyodbc.Connection, tenant: dict, compra: Compras, intento: Optional[Intento] = None):
     cursor = None
     try:
         # Generar valores
         codigo_autorizacion = generar_codigo_autorizacion()
-        nuevo_numero_cupon = await obtener_nuevo_numero_cupon(conn)
+        nuevo_numero_cupon = obtener_nuevo_numero_cupon(conn, tenant)
         
         # Configurar conexión SIN manejo de transacción (el SP lo hace internamente)
         conn.autocommit = True  # Cambio clave aquí
         
         # Ejecutar SP
         cursor = conn.cursor()
+        if intento is not None:
+            intento.enviar()
         cursor.execute("""
             DECLARE @id_compra INT;
             DECLARE @mensaje NVARCHAR(255);
@@ -166,8 +174,11 @@ async def grabar_compra_tarjeta(
         ])
         
         mensaje = cursor.fetchone()[0]
+        invalidar_limites(tenant, compra.idtarjeta)
         return {"message": mensaje}
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -176,15 +187,20 @@ async def grabar_compra_tarjeta(
     finally:
         if cursor:
             cursor.close()
-        # No cerramos la conexión aquí (la maneja FastAPI)
+        # No cerramos la conexión aquí (get_conn la devuelve al pool)
 
 
 # --- Actualizar Saldo de Tarjeta ---
 @router.put("/actualizar_saldo_tarjeta/", tags=['Tarjetas Asociados'])
 async def actualizar_saldo(
     saldos_tarjeta: Saldo_Tarjeta,
+    tenant: dict = Depends(resolve_tenant),
     conn: pyodbc.Connection = Depends(get_client_connection)
 ):
+    return await ejecutar_db(grabar_saldo_tarjeta, conn, tenant, saldos_tarjeta)
+
+
+def grabar_saldo_tarjeta(conn: pyodbc.Connection, tenant: dict, saldos_tarjeta: Saldo_Tarjeta):
     cursor = None
     try:
         conn.autocommit = True  # El SP maneja su propia transacción
@@ -195,6 +211,7 @@ async def actualizar_saldo(
             saldos_tarjeta.importe,
             saldos_tarjeta.importe_cuota
         ])
+        invalidar_limites(tenant, saldos_tarjeta.id)
         return {"message": "Saldo actualizado correctamente"}
     
     except Exception as e:
@@ -213,120 +230,381 @@ async def actualizar_saldo(
 @router.post("/grabar_compra_y_actualizar_saldo/", tags=['Registros de Compras'])
 async def grabar_compra_y_actualizar_saldo_endpoint(
     compra: Compras,
-    conn: pyodbc.Connection = Depends(get_client_connection)    
+    tenant: dict = Depends(resolve_tenant),
+    conn: ConexionDiferida = Depends(get_conn_diferida),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
-    cursor = None
+    return await registro_idempotencia.ejecutar(
+        tenant, "grabar_compra_y_actualizar_saldo", idempotency_key, compra,
+        lambda intento: ejecutar_db(
+            _grabar_con_conexion, grabar_compra_y_actualizar_saldo, conn, tenant, compra, intento
+        ),
+        conexion=conn.obtener
+    )
+
+
+# Validaciones de la compra (comercio, plan, tarjeta y saldos) compartidas con el lote de compras:
+# deja @rechazo en NULL si la compra se puede grabar y completa @importe_cuota si llegó NULL.
+_SQL_VALIDAR_COMPRA = """    IF NOT EXISTS (SELECT 1 FROM tjComercios WHERE id = @idcomercio)
+        SET @rechazo = 'COMERCIO_INEXISTENTE';
+
+    IF @rechazo IS NULL
+    BEGIN
+        SELECT @activo = ISNULL(activo, 0), @interes = ISNULL(interes, 0), @cuotas = ISNULL(cuotas, 1)
+        FROM tjPlanes WHERE id = @idplan;
+        IF @@ROWCOUNT = 0
+            SET @rechazo = 'PLAN_INEXISTENTE';
+        ELSE IF @activo = 0
+            SET @rechazo = 'PLAN_INACTIVO';
+        ELSE IF @importe_cuota IS NULL
+        BEGIN
+            SET @tem = @interes / 100;
+            IF @tem = 0
+                SET @importe_cuota = @importe / @cuotas;
+            ELSE
+                SET @importe_cuota = ROUND(@importe * (@tem * POWER(1 + @tem, @cuotas)) / (POWER(1 + @tem, @cuotas) - 1), 2);
+        END
+    END
+
+    IF @rechazo IS NULL
+    BEGIN
+        SELECT @estado = ISNULL(t.estado, 0), @saldo = ISNULL(l.saldo, 0),
+               @topemes = ISNULL(l.topemes, 0), @saldomes = ISNULL(l.saldomes, 0)
+        FROM tjTarjetas t INNER JOIN tjLimites l WITH (UPDLOCK, ROWLOCK) ON t.idtitular = l.idTarjeta
+        WHERE t.id = @idtarjeta;
+        IF @@ROWCOUNT = 0
+            SET @rechazo = 'TARJETA_INEXISTENTE';
+        ELSE IF @estado <> 1
+            SET @rechazo = 'TARJETA_INACTIVA';
+        ELSE IF @saldo < @importe
+            SET @rechazo = 'SALDO_INSUFICIENTE';
+        -- La validación mensual se hace contra el importe de cuota (saldomes = disponible mensual)
+        ELSE IF @saldomes < @importe_cuota
+            SET @rechazo = 'SALDO_MES_INSUFICIENTE';
+    END
+"""
+
+# Lote T-SQL que valida, graba la compra y actualiza el saldo en un solo viaje al servidor.
+# La transacción se maneja dentro del lote; tjLimites se lee con UPDLOCK para que dos compras
+# simultáneas de la misma tarjeta no validen contra el mismo saldo.
+# El importe de cuota se calcula en Python con el plan en cache (core.referencias); si el plan
+# no está en cache, @importe_cuota llega NULL y se calcula acá con la misma fórmula que calcular_cuotas.
+SQL_AUTORIZAR_COMPRA = """
+SET NOCOUNT ON;
+SET XACT_ABORT ON;
+DECLARE @idcomercio INT = ?, @idtarjeta INT = ?, @importe FLOAT = ?, @idplan INT = ?, @cupon INT = ?,
+        @fecha DATETIME2 = ?, @autorizacion NVARCHAR(20) = ?, @idcaja INT = ?, @importe_cuota FLOAT = ?;
+DECLARE @id_compra INT, @mensaje NVARCHAR(255), @rechazo VARCHAR(30),
+        @activo BIT, @interes FLOAT, @cuotas INT, @tem FLOAT,
+        @estado INT, @saldo FLOAT, @topemes FLOAT, @saldomes FLOAT;
+
+BEGIN TRY
+    BEGIN TRANSACTION;
+
+""" + _SQL_VALIDAR_COMPRA + """
+    IF @rechazo IS NULL
+    BEGIN
+        EXEC grabarCompra @idcomercio, @idtarjeta, @importe, @idplan, @cupon, 'A', @fecha, @autorizacion, @idcaja,
+                          @id_compra OUTPUT, @mensaje OUTPUT;
+        EXEC grabarSaldoTarjNuevo @idtarjeta, @importe, @importe_cuota;
+        COMMIT TRANSACTION;
+    END
+    ELSE
+        ROLLBACK TRANSACTION;
+END TRY
+BEGIN CATCH
+    IF @@TRANCOUNT > 0 ROLLBACK TRANSACTION;
+    SET XACT_ABORT OFF;
+    SET NOCOUNT OFF;
+    THROW;
+END CATCH;
+
+-- Las opciones SET quedan en la sesión y la conexión vuelve al pool: se restauran antes del resultado
+SET XACT_ABORT OFF;
+SET NOCOUNT OFF;
+SELECT @rechazo AS rechazo, @id_compra AS id_compra, @mensaje AS mensaje, @importe_cuota AS importe_cuota,
+       @saldo AS saldo, @saldomes AS saldomes, @topemes AS topemes;
+"""
+
+# Mensajes de rechazo (mismos textos que devolvía la validación en Python)
+RECHAZOS_COMPRA = {
+    "COMERCIO_INEXISTENTE": "Comercio id={idcomercio} no existe",
+    "PLAN_INEXISTENTE": "Plan id={idplan} no existe",
+    "PLAN_INACTIVO": "Plan id={idplan} no está activo",
+    "TARJETA_INEXISTENTE": "Tarjeta id={idtarjeta} no encontrada",
+    "TARJETA_INACTIVA": "Tarjeta id={idtarjeta} no está activa",
+    "SALDO_INSUFICIENTE": "Saldo insuficiente en tarjeta: saldo={saldo}, importe={importe}",
+    "SALDO_MES_INSUFICIENTE": "Saldo mensual insuficiente: disponible_mes={saldomes}, cuota={importe_cuota}, topeMes={topemes}",
+}
+
+
+def restaurar_opciones_sesion(conn: pyodbc.Connection):
+    """
+    Los lotes de compras activan NOCOUNT y XACT_ABORT y los desactivan al terminar; si el lote
+    se cortó antes (timeout, cancelación, error de compilación) se desactivan acá para que la
+    conexión no vuelva al pool con esas opciones.
+    """
     try:
-        # Conexión y transacción ya gestionadas por get_client_connection
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SET XACT_ABORT OFF; SET NOCOUNT OFF;")
+        finally:
+            cursor.close()
+    except Exception:
+        pass
+
+
+def autorizar_compra(conn: pyodbc.Connection, compra: Compras, cupon: int, codigo_autorizacion: str,
+                     importe_cuota: Optional[float] = None) -> dict:
+    """
+    Ejecuta SQL_AUTORIZAR_COMPRA y devuelve el resultado como diccionario
+    (rechazo, id_compra, mensaje, importe_cuota, saldo, saldomes, topemes).
+    """
+    conn.autocommit = True  # la transacción la abre y cierra el propio lote
+    cursor = conn.cursor()
+    try:
+        cursor.execute(SQL_AUTORIZAR_COMPRA, [
+            compra.idcomercio,
+            compra.idtarjeta,
+            compra.importe,
+            compra.idplan,
+            cupon,
+            compra.fecha,
+            codigo_autorizacion,
+            compra.idcaja,
+            importe_cuota
+        ])
+        # Los SP pueden emitir result sets propios: se busca el del lote
+        while not (cursor.description and cursor.description[0][0] == "rechazo"):
+            if not cursor.nextset():
+                raise RuntimeError("El lote de autorización no devolvió resultado")
+        cols = [c[0] for c in cursor.description]
+        return dict(zip(cols, cursor.fetchone()))
+    except Exception:
+        cursor.close()
+        cursor = None
+        restaurar_opciones_sesion(conn)
+        raise
+    finally:
+        if cursor:
+            cursor.close()
 
-        # 2. Generar valores
-        codigo_autorizacion = generar_codigo_autorizacion()
-        nuevo_numero_cupon = await obtener_nuevo_numero_cupon(conn)
 
-        # 3. Validaciones antes de grabar
+def grabar_compra_y_actualizar_saldo(conn: pyodbc.Connection, tenant: dict, compra: Compras,
+                                     intento: Optional[Intento] = None):
+    try:
         # Valido importe
         if compra.importe is None or compra.importe <= 0:
             raise HTTPException(status_code=400, detail="El importe de la compra debe ser mayor a cero")
 
-        cursor = conn.cursor()
+        codigo_autorizacion = generar_codigo_autorizacion()
+        nuevo_numero_cupon = obtener_nuevo_numero_cupon(conn, tenant)
 
-        # Validar que el comercio exista
-        try:
-            cursor.execute('SELECT id FROM tjComercios WHERE id = ?', [compra.idcomercio])
-            if not cursor.fetchone():
-                raise HTTPException(status_code=400, detail=f"Comercio id={compra.idcomercio} no existe")
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error al validar comercio: {str(e)}")
-
-        # Validar plan exista y esté activo, y obtener tasa/cuotas
-        try:
-            cursor.execute('SELECT activo, interes, cuotas FROM tjPlanes WHERE id = ?', [compra.idplan])
-            plan_row = cursor.fetchone()
-            if not plan_row:
-                raise HTTPException(status_code=400, detail=f"Plan id={compra.idplan} no existe")
-            activo_plan = plan_row[0]
-            tasa_interes_mensual = float(plan_row[1]) if plan_row[1] is not None else 0.0
-            cantidad_cuotas = int(plan_row[2]) if plan_row[2] is not None else 1
-            if not activo_plan:
-                raise HTTPException(status_code=400, detail=f"Plan id={compra.idplan} no está activo")
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error al validar plan: {str(e)}")
-
-        # Calcular importe de cuota
-        tarjeta_input = TarjetaInput(monto=compra.importe, tasa_interes_mensual=tasa_interes_mensual, cuotas=cantidad_cuotas)
-        resultado_cuotas = calcular_cuotas(tarjeta_input)
-        importe_cuota = 0.0
-        if resultado_cuotas and getattr(resultado_cuotas, 'cuotas', None):
-            importe_cuota = float(resultado_cuotas.cuotas[0].monto_cuota)
-
-        # Validar tarjeta (estado, saldo total y saldo mes)
-        try:
-            cursor.execute('''
-                SELECT t.id, tjLimites.tope, tjLimites.saldo, tjLimites.topemes, tjLimites.saldomes, t.estado
-                FROM tjTarjetas t INNER JOIN tjLimites ON t.idtitular = tjLimites.idTarjeta
-                WHERE t.id = ?
-            ''', [compra.idtarjeta])
-            tarjeta_row = cursor.fetchone()
-            if not tarjeta_row:
-                raise HTTPException(status_code=400, detail=f"Tarjeta id={compra.idtarjeta} no encontrada")
-            saldo_total = float(tarjeta_row[2]) if tarjeta_row[2] is not None else 0.0
-            topemes = float(tarjeta_row[3]) if tarjeta_row[3] is not None else 0.0
-            saldomes = float(tarjeta_row[4]) if tarjeta_row[4] is not None else 0.0
-            estado_tarjeta = int(tarjeta_row[5]) if tarjeta_row[5] is not None else 0
-            if estado_tarjeta != 1:
-                raise HTTPException(status_code=400, detail=f"Tarjeta id={compra.idtarjeta} no está activa")
-            if saldo_total < compra.importe:
-                raise HTTPException(status_code=400, detail=f"Saldo insuficiente en tarjeta: saldo={saldo_total}, importe={compra.importe}")
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error al validar tarjeta: {str(e)}")
-
-        # La validación mensual debe hacerse contra el importe de cuota.
-        # saldomes representa el disponible mensual actual.
-        if saldomes < importe_cuota:
+        # Validaciones, grabarCompra y grabarSaldoTarjNuevo en un único lote
+        # (plan, activo y saldos se validan en el lote; del cache solo sale el importe de cuota)
+        importe_cuota = calcular_importe_cuota(tenant, compra, conn)
+        if intento is not None:
+            intento.enviar()
+        resultado = autorizar_compra(conn, compra, nuevo_numero_cupon, codigo_autorizacion, importe_cuota)
+
+        rechazo = resultado["rechazo"]
+        if rechazo:
             raise HTTPException(
                 status_code=400,
-                detail=(
-                    f"Saldo mensual insuficiente: disponible_mes={saldomes}, "
-                    f"cuota={importe_cuota}, topeMes={topemes}"
+                detail=RECHAZOS_COMPRA[rechazo].format(
+                    idcomercio=compra.idcomercio, idplan=compra.idplan, idtarjeta=compra.idtarjeta,
+                    importe=compra.importe, **{k: resultado[k] for k in ("saldo", "saldomes", "topemes", "importe_cuota")}
                 )
             )
 
-        # 4. Ejecutar transacción: grabarCompra
-        cursor.execute("""
-            DECLARE @id_compra INT;
-            DECLARE @mensaje NVARCHAR(255);
-            EXEC grabarCompra ?, ?, ?, ?, ?, ?, ?, ?, ?, @id_compra OUTPUT, @mensaje OUTPUT;
-            SELECT @mensaje;
-        """, [
-            compra.idcomercio,
-            compra.idtarjeta,
-            compra.importe,
-            compra.idplan,
-            nuevo_numero_cupon,
-            'A',
-            compra.fecha,
-            codigo_autorizacion,
-            compra.idcaja
-        ])
-        mensaje = cursor.fetchone()[0]
-
-        # Ejecutar actualización de saldo pasando ahora el importe de la cuota
-        cursor.execute("exec grabarSaldoTarjNuevo ?, ?, ?", [compra.idtarjeta, compra.importe, importe_cuota])
-        conn.commit()
-        return {"message": mensaje}
+        invalidar_limites(tenant, compra.idtarjeta)
+        return {
+            "message": resultado["mensaje"],
+            "id_compra": resultado["id_compra"],
+            "cupon": nuevo_numero_cupon,
+            "autorizacion": codigo_autorizacion,
+            "importe_cuota": resultado["importe_cuota"],
+        }
 
     except HTTPException:
         raise  # Re-lanza las excepciones HTTP que ya manejamos
     except Exception as e:
-        if conn:
-            conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
+
+
+# --- Grabar Compras en Lote ---
+# Para terminales que acumularon ventas sin conexión: las compras se validan contra los planes
+# en cache, reciben cupones de un único bloque, se cargan a una tabla temporal con
+# fast_executemany y un solo lote T-SQL aplica cada una (mismas reglas que
+# /grabar_compra_y_actualizar_saldo/, en su propia transacción) devolviendo el resultado por compra.
+MAX_COMPRAS_LOTE = 1000
+
+SQL_CREAR_COMPRAS_LOTE = """
+IF OBJECT_ID('tempdb..#compras_lote') IS NOT NULL DROP TABLE #compras_lote;
+CREATE TABLE #compras_lote (
+    orden INT PRIMARY KEY, idcomercio INT, idtarjeta INT, importe FLOAT, idplan INT, cupon INT,
+    carga NVARCHAR(10), fecha DATETIME2, autorizacion NVARCHAR(20), idcaja INT, importe_cuota FLOAT NULL,
+    rechazo VARCHAR(30) NULL, id_compra INT NULL, mensaje NVARCHAR(255) NULL,
+    saldo FLOAT NULL, saldomes FLOAT NULL, topemes FLOAT NULL, error NVARCHAR(4000) NULL
+);
+"""
+
+SQL_INSERTAR_COMPRAS_LOTE = """
+INSERT INTO #compras_lote (orden, idcomercio, idtarjeta, importe, idplan, cupon, carga, fecha, autorizacion, idcaja, importe_cuota)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+"""
+
+SQL_APLICAR_COMPRAS_LOTE = """
+SET NOCOUNT ON;
+SET XACT_ABORT ON;
+DECLARE @orden INT = -1, @idcomercio INT, @idtarjeta INT, @importe FLOAT, @idplan INT, @cupon INT,
+        @carga NVARCHAR(10), @fecha DATETIME2, @autorizacion NVARCHAR(20), @idcaja INT, @importe_cuota FLOAT;
+DECLARE @id_compra INT, @mensaje NVARCHAR(255), @rechazo VARCHAR(30), @error NVARCHAR(4000),
+        @activo BIT, @interes FLOAT, @cuotas INT, @tem FLOAT,
+        @estado INT, @saldo FLOAT, @topemes FLOAT, @saldomes FLOAT;
+
+WHILE 1 = 1
+BEGIN
+    SELECT TOP 1 @orden = orden, @idcomercio = idcomercio, @idtarjeta = idtarjeta, @importe = importe,
+           @idplan = idplan, @cupon = cupon, @carga = carga, @fecha = fecha, @autorizacion = autorizacion,
+           @idcaja = idcaja, @importe_cuota = importe_cuota
+    FROM #compras_lote WHERE orden > @orden ORDER BY orden;
+    IF @@ROWCOUNT = 0 BREAK;
+
+    SELECT @rechazo = NULL, @id_compra = NULL, @mensaje = NULL, @error = NULL,
+           @saldo = NULL, @saldomes = NULL, @topemes = NULL;
+
+    BEGIN TRY
+        BEGIN TRANSACTION;
+""" + _SQL_VALIDAR_COMPRA + """
+        IF @rechazo IS NULL
+        BEGIN
+            EXEC grabarCompra @idcomercio, @idtarjeta, @importe, @idplan, @cupon, @carga, @fecha, @autorizacion, @idcaja,
+                              @id_compra OUTPUT, @mensaje OUTPUT;
+            EXEC grabarSaldoTarjNuevo @idtarjeta, @importe, @importe_cuota;
+            COMMIT TRANSACTION;
+        END
+        ELSE
+            ROLLBACK TRANSACTION;
+    END TRY
+    BEGIN CATCH
+        IF @@TRANCOUNT > 0 ROLLBACK TRANSACTION;
+        SET @error = ERROR_MESSAGE();
+    END CATCH;
+
+    -- Fuera de la transacción: si se deshizo, el resultado de la compra igual queda registrado
+    UPDATE #compras_lote
+    SET rechazo = @rechazo, id_compra = @id_compra, mensaje = @mensaje, importe_cuota = @importe_cuota,
+        saldo = @saldo, saldomes = @saldomes, topemes = @topemes, error = @error
+    WHERE orden = @orden;
+END
+
+SET XACT_ABORT OFF;
+SET NOCOUNT OFF;
+SELECT orden, rechazo, id_compra, mensaje, importe_cuota, saldo, saldomes, topemes, error
+FROM #compras_lote ORDER BY orden;
+DROP TABLE #compras_lote;
+"""
+
+
+@router.post("/grabar_compras_lote/", tags=['Registros de Compras'])
+async def grabar_compras_lote_endpoint(
+    lote: Compras_Lote,
+    tenant: dict = Depends(resolve_tenant),
+    conn: pyodbc.Connection = Depends(get_client_connection)
+):
+    if len(lote.compras) > MAX_COMPRAS_LOTE:
+        raise HTTPException(status_code=400, detail=f"Máximo {MAX_COMPRAS_LOTE} compras por lote")
+    return await ejecutar_db(grabar_compras_lote, conn, tenant, lote.compras)
+
+
+def _rechazo_compra(compra: Compras, rechazo: str, **valores) -> str:
+    datos = dict(saldo=None, saldomes=None, topemes=None, importe_cuota=None)
+    datos.update(valores)
+    return RECHAZOS_COMPRA[rechazo].format(
+        idcomercio=compra.idcomercio, idplan=compra.idplan, idtarjeta=compra.idtarjeta,
+        importe=compra.importe, **datos
+    )
+
+
+def grabar_compras_lote(conn: pyodbc.Connection, tenant: dict, compras: List[Compras]):
+    resultados = [{"orden": i, "ok": False} for i in range(len(compras))]
+
+    # Validación previa con los planes en cache (el lote vuelve a validar todo en el servidor)
+    try:
+        catalogo = referencias.catalogo_planes(tenant, conn)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al obtener planes: {str(e)}")
+    validas = []
+    for i, compra in enumerate(compras):
+        plan = catalogo.por_id.get(compra.idplan)
+        if compra.importe is None or compra.importe <= 0:
+            resultados[i]["error"] = "El importe de la compra debe ser mayor a cero"
+        elif plan is not None and not plan.activo:
+            resultados[i]["error"] = _rechazo_compra(compra, "PLAN_INACTIVO")
+        else:
+            validas.append(i)
+    if not validas:
+        return {"grabadas": 0, "rechazadas": len(compras), "resultados": resultados}
+
+    cursor = None
+    try:
+        # Un solo UPDATE en Numeros para todos los cupones del lote
+        primero, _ = reservar_bloque(conn, len(validas))
+
+        filas = []
+        for n, i in enumerate(validas):
+            compra = compras[i]
+            cupon = primero + n
+            codigo_autorizacion = generar_codigo_autorizacion()
+            resultados[i].update(cupon=cupon, autorizacion=codigo_autorizacion)
+            filas.append((
+                i, compra.idcomercio, compra.idtarjeta, compra.importe, compra.idplan, cupon,
+                compra.carga or 'A', compra.fecha, codigo_autorizacion, compra.idcaja,
+                calcular_importe_cuota(tenant, compra, conn)
+            ))
+
+        conn.autocommit = True  # cada compra abre y cierra su transacción dentro del lote
+        cursor = conn.cursor()
+        cursor.execute(SQL_CREAR_COMPRAS_LOTE)
+        cursor.fast_executemany = True
+        cursor.executemany(SQL_INSERTAR_COMPRAS_LOTE, filas)
+        cursor.execute(SQL_APLICAR_COMPRAS_LOTE)
+        # Los SP pueden emitir result sets propios: se busca el del lote
+        while not (cursor.description and cursor.description[0][0] == "orden"):
+            if not cursor.nextset():
+                raise RuntimeError("El lote de compras no devolvió resultado")
+        cols = [c[0] for c in cursor.description]
+        filas_resultado = [dict(zip(cols, row)) for row in cursor.fetchall()]
+    except HTTPException:
+        raise
+    except Exception as e:
+        if cursor:
+            cursor.close()
+            cursor = None
+        restaurar_opciones_sesion(conn)
+        raise HTTPException(status_code=500, detail=f"Error al grabar compras: {str(e)}")
     finally:
         if cursor:
             cursor.close()
+
+    tarjetas = set()
+    for fila in filas_resultado:
+        resultado = resultados[fila["orden"]]
+        compra = compras[fila["orden"]]
+        if fila["error"]:
+            resultado["error"] = fila["error"]
+        elif fila["rechazo"]:
+            resultado["error"] = _rechazo_compra(
+                compra, fila["rechazo"], **{k: fila[k] for k in ("saldo", "saldomes", "topemes", "importe_cuota")}
+            )
+        else:
+            resultado.update(
+                ok=True, message=fila["mensaje"], id_compra=fila["id_compra"], importe_cuota=fila["importe_cuota"]
+            )
+            tarjetas.add(compra.idtarjeta)
+    for idtarjeta in tarjetas:
+        invalidar_limites(tenant, idtarjeta)
+
+    grabadas = sum(1 for r in resultados if r["ok"])
+    return {"grabadas": grabadas, "rechazadas": len(compras) - grabadas, "resultados": resultados}
@@ -0,0 +1,221 @@
+# API_TARJETA_MULTI\routers\multiples.py
+# Varias consultas de lectura en un solo request (pantalla de inicio de la app móvil):
+# tenant y JWT se validan una vez y las consultas que van a la BD comparten una conexión.
+import asyncio
+import threading
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+from fastapi import APIRouter, HTTPException, Depends, Response
+from pydantic import BaseModel
+
+from auth import require_user
+from tenants import resolve_tenant, ConexionDiferida
+from core import referencias
+from core.db_async import ejecutar_db
+from core.limites import limites_tarjeta
+from core.pool import conexion_tenant
+from . import consultas, usuario
+from .grabaciones import obtener_consumido_tarjeta
+
+router = APIRouter()
+
+MAX_CONSULTAS_LOTE = 20
+
+
+class SubConsulta(BaseModel):
+    ruta: str                           # ej.: "/tarjetas/", "/compras/?id_tarjeta=5", "/ver_limites/123"
+    params: Dict[str, Any] = {}
+    id: Optional[str] = None            # se devuelve tal cual para identificar el resultado
+
+class Lote_Consultas(BaseModel):
+    consultas: List[SubConsulta]
+
+class ResultadoSubConsulta(BaseModel):
+    id: Optional[str] = None
+    ruta: str
+    status: int
+    cuerpo: Any = None
+    error: Optional[str] = None
+
+
+class _ConexionLote:
+    """
+    Conexión prestada para las consultas del lote que van a la BD (una tras otra, en un solo
+    hilo). Las funciones de los endpoints la cierran al terminar, así que close() no hace nada:
+    vuelve al pool cuando termina la última consulta.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, nombre):
+        return getattr(self._conn, nombre)
+
+    def close(self):
+        pass
+
+
+class _Contexto:
+    def __init__(self, tenant: dict, user: dict, conn: Optional[_ConexionLote]):
+        self.tenant = tenant
+        self.user = user
+        self.conn = conn
+
+
+def _param(params: Dict[str, Any], nombre: str, tipo: Callable = int):
+    if nombre not in params:
+        raise HTTPException(status_code=400, detail=f"Falta el parámetro '{nombre}'")
+    try:
+        return tipo(params[nombre])
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Parámetro '{nombre}' inválido")
+
+
+# Consultas admitidas: ruta => (usa la conexión compartida, función(contexto, params)).
+# Las que solo leen caches en memoria (o cargan con su propia conexión) corren en paralelo;
+# las que usan la conexión corren después, una tras otra en un solo hilo de BD.
+# Los endpoints se llaman con argumentos por nombre para no depender del orden de sus parámetros.
+_CONSULTAS: Dict[str, tuple] = {
+    "/me": (False, lambda ctx, p: {
+        "sub": ctx.user.get("sub"), "name": ctx.user.get("name"), "roles": ctx.user.get("roles", [])
+    }),
+    "/estados": (False, lambda ctx, p: referencias.estados(tenant=ctx.tenant)),
+    "/estados/": (False, lambda ctx, p: consultas.buscar_estado(id_estado=_param(p, "id_estado"), tenant=ctx.tenant)),
+    "/planes": (False, lambda ctx, p: referencias.catalogo_planes(tenant=ctx.tenant).planes),
+    "/planes/": (False, lambda ctx, p: consultas.buscar_plan(id_plan=_param(p, "id_plan"), tenant=ctx.tenant)),
+    "/planesComercios/": (False, lambda ctx, p: referencias.planes_de_comercio(
+        tenant=ctx.tenant, id_comercio=_param(p, "id_comercio")
+    )),
+    "/cajasComercios/": (False, lambda ctx, p: referencias.cajas_de_comercio(
+        tenant=ctx.tenant, id_comercio=_param(p, "id_comercio")
+    )),
+    "/TarjetaComercio/": (True, lambda ctx, p: usuario.identificar_usuario(
+        User_id=_param(p, "User_id", str), conn=ctx.conn
+    )),
+    "/tarjetas/": (True, lambda ctx, p: consultas.buscar_tarjeta(
+        response=Response(), id_tarjeta=_param(p, "id_tarjeta"), tenant=ctx.tenant,
+        conn=ConexionDiferida(ctx.tenant, ctx.conn)
+    )),
+    "/compras/": (True, lambda ctx, p: consultas.ultimas_compras(
+        id_tarjeta=_param(p, "id_tarjeta"), conn=ConexionDiferida(ctx.tenant, ctx.conn), tenant=ctx.tenant
+    )),
+    "/cuotas/": (True, lambda ctx, p: consultas.detalle_cuotas(
+        id_compra=_param(p, "id_compra"), tenant=ctx.tenant, conn=ConexionDiferida(ctx.tenant, ctx.conn)
+    )),
+    "/comercios/": (True, lambda ctx, p: consultas.buscar_comercio(
+        id_comercio=_param(p, "id_comercio"), conn=ConexionDiferida(ctx.tenant, ctx.conn), tenant=ctx.tenant
+    )),
+    "/ver_limites/": (True, lambda ctx, p: _ver_limites(ctx, _param(p, "numero_tarjeta", str))),
+    "/ver_consumido/": (True, lambda ctx, p: obtener_consumido_tarjeta(
+        conn=ctx.conn, numero_tarjeta=_param(p, "numero_tarjeta")
+    )),
+}
+
+# Rutas con el número de tarjeta en el path (/ver_limites/{numero_tarjeta})
+_CON_PARAMETRO_EN_RUTA = {"/ver_limites/": "numero_tarjeta", "/ver_consumido/": "numero_tarjeta"}
+
+
+def _ver_limites(ctx: _Contexto, numero_tarjeta: str):
+    limites, _ = limites_tarjeta(ctx.tenant, numero_tarjeta, conn=ctx.conn)
+    if not limites:
+        raise HTTPException(status_code=404, detail=f"No se encontraron límites para tarjeta {numero_tarjeta}")
+    return limites
+
+
+def _resolver(sub: SubConsulta):
+    """Devuelve (ruta, params, (usa_conexion, función)) o lanza 404 si la ruta no está admitida."""
+    partes = urlsplit(sub.ruta)
+    ruta = partes.path
+    params = dict(parse_qsl(partes.query))
+    params.update(sub.params)
+    if ruta not in _CONSULTAS:
+        for prefijo, nombre in _CON_PARAMETRO_EN_RUTA.items():
+            if ruta.startswith(prefijo) and ruta[len(prefijo):].strip("/"):
+                params[nombre] = ruta[len(prefijo):].strip("/")
+                ruta = prefijo
+                break
+    if ruta not in _CONSULTAS:
+        raise HTTPException(status_code=404, detail=f"Ruta no admitida en lote: {sub.ruta}")
+    return ruta, params, _CONSULTAS[ruta]
+
+
+def _resultado(ctx: _Contexto, sub: SubConsulta, resuelta) -> ResultadoSubConsulta:
+    try:
+        if isinstance(resuelta, HTTPException):
+            raise resuelta
+        ruta, params, (_, funcion) = resuelta
+        cuerpo = funcion(ctx, params)
+        return ResultadoSubConsulta(id=sub.id, ruta=sub.ruta, status=200, cuerpo=cuerpo)
+    except HTTPException as e:
+        return ResultadoSubConsulta(id=sub.id, ruta=sub.ruta, status=e.status_code, error=str(e.detail))
+    except Exception as e:
+        return ResultadoSubConsulta(id=sub.id, ruta=sub.ruta, status=500, error=str(e))
+
+
+def _resultados_con_conexion(tenant: dict, user: dict, pendientes: list, cancelado: threading.Event) -> list:
+    """
+    Ejecuta una tras otra, en el hilo actual, las consultas que usan la conexión: el lote ocupa
+    un solo hilo de BD y una conexión, que vuelve al pool al terminar (aunque se haya cancelado).
+    """
+    with conexion_tenant(tenant) as conn:
+        ctx = _Contexto(tenant, user, _ConexionLote(conn))
+        resultados = []
+        for sub, resuelta in pendientes:
+            if cancelado.is_set():
+                break
+            resultados.append(_resultado(ctx, sub, resuelta))
+        return resultados
+
+
+# Ejecutar varias consultas de lectura; cada resultado trae su propio status (200, 400, 404, 500...)
+@router.post('/multiples/', response_model=List[ResultadoSubConsulta], tags=['Consultas múltiples'])
+async def consultas_multiples(
+    lote: Lote_Consultas,
+    tenant: dict = Depends(resolve_tenant),
+    user: dict = Depends(require_user),
+):
+    if len(lote.consultas) > MAX_CONSULTAS_LOTE:
+        raise HTTPException(status_code=400, detail=f"Máximo {MAX_CONSULTAS_LOTE} consultas por lote")
+
+    resueltas = []
+    for sub in lote.consultas:
+        try:
+            resueltas.append(_resolver(sub))
+        except HTTPException as e:
+            resueltas.append(e)
+
+    usa_conexion = [not isinstance(r, HTTPException) and r[2][0] for r in resueltas]
+    con_conexion = [i for i, usa in enumerate(usa_conexion) if usa]
+    sin_conexion = [i for i, usa in enumerate(usa_conexion) if not usa]
+
+    # Primero las que no usan la conexión compartida (en paralelo): si alguna tiene que cargar un
+    # cache pide su propia conexión al pool, y el lote todavía no retiene ninguna
+    ctx = _Contexto(tenant, user, None)
+    resultados: List[Optional[ResultadoSubConsulta]] = [None] * len(resueltas)
+    parciales = await asyncio.gather(*(
+        ejecutar_db(_resultado, ctx, lote.consultas[i], resueltas[i]) for i in sin_conexion
+    ))
+    for i, resultado in zip(sin_conexion, parciales):
+        resultados[i] = resultado
+
+    if con_conexion:
+        cancelado = threading.Event()
+        try:
+            parciales = await ejecutar_db(
+                _resultados_con_conexion, tenant, user,
+                [(lote.consultas[i], resueltas[i]) for i in con_conexion], cancelado
+            )
+        except asyncio.CancelledError:
+            cancelado.set()   # el hilo termina la consulta en curso y devuelve la conexión
+            raise
+        except HTTPException as e:
+            # Sin conexión para el lote (pool agotado, BD caída...): el error va en cada consulta
+            parciales = [
+                ResultadoSubConsulta(id=lote.consultas[i].id, ruta=lote.consultas[i].ruta,
+                                     status=e.status_code, error=str(e.detail))
+                for i in con_conexion
+            ]
+        for i, resultado in zip(con_conexion, parciales):
+            resultados[i] = resultado
+    return resultados
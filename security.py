@@ -1,7 +1,12 @@
 import base64, hashlib, hmac, struct
+import asyncio, threading, time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timezone
+from typing import Dict, Optional
 import jwt
-from settings import JWT_SECRET, JWT_ISSUER, JWT_AUDIENCE, jwt_exp_delta
+from fastapi import HTTPException
+from settings import (JWT_SECRET, JWT_ISSUER, JWT_AUDIENCE, jwt_exp_delta,
+                      PWD_WORKERS, PWD_MAX_PENDIENTES, PWD_MAX_POR_TENANT, PWD_TIMEOUT_SEG)
 
 # -------- V3 (ASP.NET Core Identity) --------
 def verify_aspnet_identity_v3(hashed_base64: str, password: str) -> bool:
@@ -46,6 +51,110 @@ def verify_password_hash(hashed_base64: str, password: str) -> bool:
     # Luego v2 (tu caso actual)
     return verify_aspnet_identity_v2(hashed_base64, password)
 
+# -------- Verificación fuera del event loop --------
+# PBKDF2 (hasta cientos de miles de iteraciones en v3) corre en un pool de procesos dedicado,
+# con una cola acotada global y un tope de verificaciones simultáneas por tenant.
+_verificador: Optional[ProcessPoolExecutor] = None
+_pendientes = 0
+_pendientes_tenant: Dict[str, int] = {}
+_lock = threading.Lock()
+_metricas: Dict[str, Dict[str, float]] = {}
+_rechazos = {"429": 0, "503": 0}
+
+
+def version_hash(hashed_base64: str) -> str:
+    try:
+        marca = base64.b64decode(hashed_base64)[:1]
+    except Exception:
+        return "invalido"
+    return {b"\x00": "v2", b"\x01": "v3"}.get(marca, "invalido")
+
+
+def _verificar_medido(hashed_base64: str, password: str):
+    # Se ejecuta en el proceso hijo: devuelve el resultado y cuánto tardó el cálculo
+    inicio = time.perf_counter()
+    ok = verify_password_hash(hashed_base64, password)
+    return ok, time.perf_counter() - inicio
+
+
+def _get_verificador() -> ProcessPoolExecutor:
+    global _verificador
+    with _lock:
+        if _verificador is None:
+            _verificador = ProcessPoolExecutor(max_workers=PWD_WORKERS)
+        return _verificador
+
+
+def _registrar(version: str, segundos: float):
+    with _lock:
+        m = _metricas.setdefault(version, {"cantidad": 0, "segundos_total": 0.0, "segundos_max": 0.0})
+        m["cantidad"] += 1
+        m["segundos_total"] += segundos
+        m["segundos_max"] = max(m["segundos_max"], segundos)
+
+
+async def verificar_password(cuit: str, hashed_base64: str, password: str) -> bool:
+    """
+    Verifica la contraseña en el pool de procesos.
+    429 si el tenant ya tiene PWD_MAX_POR_TENANT verificaciones en curso,
+    503 si la cola global está llena o la verificación excede PWD_TIMEOUT_SEG.
+    """
+    global _pendientes
+    with _lock:
+        if _pendientes >= PWD_MAX_PENDIENTES:
+            _rechazos["503"] += 1
+            raise HTTPException(status_code=503, detail="Servicio de autenticación saturado, reintente")
+        if _pendientes_tenant.get(cuit, 0) >= PWD_MAX_POR_TENANT:
+            _rechazos["429"] += 1
+            raise HTTPException(status_code=429, detail="Demasiados intentos de login simultáneos")
+        _pendientes += 1
+        _pendientes_tenant[cuit] = _pendientes_tenant.get(cuit, 0) + 1
+    try:
+        trabajo = _get_verificador().submit(_verificar_medido, hashed_base64, password)
+    except BaseException:
+        _liberar(cuit)
+        raise
+    # El cupo se libera cuando el proceso termina (o el trabajo se cancela antes de empezar),
+    # no cuando el request deja de esperar: un PBKDF2 que excedió el tiempo sigue ocupando un worker
+    trabajo.add_done_callback(lambda _: _liberar(cuit))
+    try:
+        ok, segundos = await asyncio.wait_for(asyncio.wrap_future(trabajo), PWD_TIMEOUT_SEG)
+    except asyncio.TimeoutError:
+        with _lock:
+            _rechazos["503"] += 1
+        raise HTTPException(status_code=503, detail="Tiempo de verificación excedido, reintente")
+    _registrar(version_hash(hashed_base64), segundos)
+    return ok
+
+
+def _liberar(cuit: str):
+    global _pendientes
+    with _lock:
+        _pendientes -= 1
+        _pendientes_tenant[cuit] -= 1
+        if not _pendientes_tenant[cuit]:
+            del _pendientes_tenant[cuit]
+
+
+def estadisticas_password() -> Dict:
+    with _lock:
+        return {
+            "pendientes": _pendientes,
+            "rechazos": dict(_rechazos),
+            "por_version": {
+                v: {**m, "segundos_promedio": m["segundos_total"] / m["cantidad"]}
+                for v, m in _metricas.items()
+            },
+        }
+
+
+def cerrar_verificador():
+    global _verificador
+    with _lock:
+        verificador, _verificador = _verificador, None
+    if verificador is not None:
+        verificador.shutdown(wait=False, cancel_futures=True)
+
 # -------- JWT --------
 def create_access_token(sub: str, name: str, roles: list[str]) -> str:
     now = datetime.now(timezone.utc)
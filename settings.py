@@ -14,6 +14,66 @@ JWT_SECRET = os.getenv("JWT_SECRET")
 JWT_ISSUER = os.getenv("JWT_ISSUER")
 JWT_AUDIENCE = os.getenv("JWT_AUDIENCE")
 JWT_EXPIRES_MIN = int(os.getenv("JWT_EXPIRES_MIN", "60"))
+JWT_CACHE_MAX = int(os.getenv("JWT_CACHE_MAX", "10000"))   # tokens ya verificados que se recuerdan (LRU)
+
+# Verificación de contraseñas (PBKDF2) en un pool de procesos
+PWD_WORKERS = int(os.getenv("PWD_WORKERS", str(os.cpu_count() or 2)))
+PWD_MAX_PENDIENTES = int(os.getenv("PWD_MAX_PENDIENTES", str(PWD_WORKERS * 4)))   # más que esto en cola => 503
+PWD_MAX_POR_TENANT = int(os.getenv("PWD_MAX_POR_TENANT", str(max(2, PWD_WORKERS))))  # en curso por tenant => 429
+PWD_TIMEOUT_SEG = float(os.getenv("PWD_TIMEOUT_SEG", "10"))
+
+# Registro de clientes (DB maestra) en memoria
+TENANTS_REFRESH_SEG = float(os.getenv("TENANTS_REFRESH_SEG", "300"))   # recarga completa de la tabla clientes
+TENANTS_NEG_TTL_SEG = float(os.getenv("TENANTS_NEG_TTL_SEG", "60"))    # cuánto se recuerda un CUIT inexistente
+
+# Token para los endpoints de administración (/_admin/...). Vacío = deshabilitados
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Pool de conexiones por tenant
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))                    # conexiones que se conservan aunque estén inactivas
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))                   # máximo de conexiones abiertas por tenant
+DB_POOL_IDLE_SEG = float(os.getenv("DB_POOL_IDLE_SEG", "300"))      # se cierran las libres que superen este tiempo
+DB_POOL_TIMEOUT_SEG = float(os.getenv("DB_POOL_TIMEOUT_SEG", "15")) # espera máxima por una conexión libre
+DB_POOL_PING_SEG = float(os.getenv("DB_POOL_PING_SEG", "30"))       # se verifica (SELECT 1) si estuvo libre más que esto
+
+# Números de cupón: se reservan de a bloques en la tabla Numeros
+CUPON_BLOQUE = int(os.getenv("CUPON_BLOQUE", "20"))                    # 1 = un UPDATE por compra (sin bloques)
+CUPON_UMBRAL = int(os.getenv("CUPON_UMBRAL", str(max(1, CUPON_BLOQUE // 4))))  # restantes para pedir el siguiente bloque
+
+# Cache de tablas de referencia (tjPlanes, tjEstados, tjPlanComercio, tjCajaComercios)
+CACHE_REF_TTL_SEG = float(os.getenv("CACHE_REF_TTL_SEG", "300"))
+CACHE_REF_MAX = int(os.getenv("CACHE_REF_MAX", "5000"))    # entradas en total (todos los tenants)
+
+# Cache de límites de tarjetas (verLimites): vida corta, se invalida al grabar por la API
+LIMITES_TTL_SEG = float(os.getenv("LIMITES_TTL_SEG", "5"))
+LIMITES_CACHE_MAX = int(os.getenv("LIMITES_CACHE_MAX", "20000"))
+
+# Exportaciones: filas que se leen por vez con fetchmany
+EXPORT_FILAS_LOTE = int(os.getenv("EXPORT_FILAS_LOTE", "1000"))
+
+# Hilos dedicados a las llamadas pyodbc de los endpoints async (core.db_async)
+DB_THREADS = int(os.getenv("DB_THREADS", "32"))
+
+# Detalle de cuotas calculado en la API (core.cronograma) en lugar de EXEC DetalleCuotas_App
+CUOTAS_LOCAL = os.getenv("CUOTAS_LOCAL", "0").lower() in ("1", "true", "si", "yes")
+# Calendario de cada cliente: "cuit:dia_cierre:dia_vencimiento,..." (sin calendario => siempre el SP)
+CUOTAS_CALENDARIOS = os.getenv("CUOTAS_CALENDARIOS", "")
+# Tabla y columna (con el IdOperacion de la compra) donde se registran ajustes o devoluciones de
+# compras, ej. "tjAjustes.idCompra". Vacío = no se puede descartar un ajuste => siempre el SP
+CUOTAS_AJUSTES = os.getenv("CUOTAS_AJUSTES", "")
+# /tarjetas/compromisos/: máximo de compras que se resuelven con DetalleCuotas_App (una ejecución
+# por compra) en un request; más que esto => 413 (pedir menos tarjetas por vez)
+COMPROMISOS_MAX_SP = int(os.getenv("COMPROMISOS_MAX_SP", "200"))
+
+# Nodos (0-9) que pueden usar los procesos de este servidor en los códigos de autorización:
+# cada proceso toma uno libre en la DB maestra (core.autorizacion), ej. "0-9", "0-4", "5,7-9"
+AUTORIZACION_NODOS = os.getenv("AUTORIZACION_NODOS", "0-9")
+AUTORIZACION_LEASE_SEG = int(os.getenv("AUTORIZACION_LEASE_SEG", "5"))   # sin verificar el nodo en este plazo, 503
+
+# Idempotency-Key en grabaciones de compras (core.idempotencia)
+IDEMPOTENCIA_TTL_SEG = int(os.getenv("IDEMPOTENCIA_TTL_SEG", "86400"))
+IDEMPOTENCIA_MAX = int(os.getenv("IDEMPOTENCIA_MAX", "50000"))
+IDEMPOTENCIA_TABLA = os.getenv("IDEMPOTENCIA_TABLA", "")   # tabla en la BD del tenant; vacío = solo memoria
 
 def odbc_conn_str():
     return (
@@ -1,8 +1,10 @@
 # tenants.py  (reemplazar completo)
-from typing import Dict, Optional
+from typing import Dict, Iterator, Optional
 import pyodbc
 from fastapi import Depends, Header, HTTPException
 from core.database import get_cliente_config
+from core.pool import conexion_tenant, prestar_conexion
+from core.metricas import marcar_tenant
 
 def _unauthorized(detail="Tenant no autorizado"):
     raise HTTPException(status_code=401, detail=detail)
@@ -25,6 +27,7 @@ def resolve_tenant(
     cliente = get_cliente_config(cuit)
     if token_cliente != cliente.token_acceso:
         _unauthorized("Token del cliente inválido")
+    marcar_tenant(cliente.cuit)
 
     conn_str = (
         f"Driver={cliente.driver_odbc};"
@@ -40,9 +43,49 @@ def resolve_tenant(
         "conn_str": conn_str,
     }
 
-def get_conn(tenant: Dict = Depends(resolve_tenant)) -> pyodbc.Connection:
-    """Conexión a la BD del tenant (por request)."""
-    return pyodbc.connect(tenant["conn_str"])
+def get_conn(tenant: Dict = Depends(resolve_tenant)) -> Iterator[pyodbc.Connection]:
+    """
+    Conexión a la BD del tenant, prestada por el pool del tenant.
+    Se devuelve al pool al terminar el request (aunque el endpoint no la cierre).
+    """
+    with conexion_tenant(tenant) as conn:
+        yield conn
+
+class ConexionDiferida:
+    """
+    Conexión del tenant que se pide al pool recién en obtener(). Las lecturas agrupadas
+    (routers.consultas.leer_una_vez) la piden dentro de la lectura: quien espera el resultado
+    de otra no ocupa una conexión. Con `conn` usa esa conexión (no la devuelve al cerrar).
+    """
+
+    def __init__(self, tenant: Dict, conn: Optional[pyodbc.Connection] = None):
+        self._tenant = tenant
+        self._conn = conn
+        self._propia = conn is None
+
+    @property
+    def retenida(self) -> bool:
+        """True si usa una conexión que el llamador ya tenía antes de la lectura."""
+        return not self._propia
+
+    def obtener(self) -> pyodbc.Connection:
+        if self._conn is None:
+            self._conn = prestar_conexion(self._tenant)
+        return self._conn
+
+    def close(self):
+        if self._propia and self._conn is not None:
+            conn, self._conn = self._conn, None
+            conn.close()
+
+
+def get_conn_diferida(tenant: Dict = Depends(resolve_tenant)) -> Iterator[ConexionDiferida]:
+    """Como get_conn, pero la conexión se pide al pool solo si el endpoint la usa."""
+    conexion = ConexionDiferida(tenant)
+    try:
+        yield conexion
+    finally:
+        conexion.close()
 
 # Alias por compatibilidad con main.py
 def require_tenant(tenant: Dict = Depends(resolve_tenant)) -> Dict: